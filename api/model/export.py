@@ -0,0 +1,64 @@
+import argparse
+
+import numpy as np
+import torch
+
+from api.model.registry import DEFAULT_CHECKPOINT, DEFAULT_ONNX, IN_CHANNELS, get_model
+from api.model.inference import predict_batches
+
+PATCH_SIZE = 224
+OPSET_VERSION = 17
+
+
+def export_onnx(checkpoint_path=DEFAULT_CHECKPOINT, onnx_path=DEFAULT_ONNX, patch_size=PATCH_SIZE):
+    """Export the UNet checkpoint to an ONNX graph with a dynamic batch dimension."""
+    model = get_model(checkpoint_path, device=torch.device('cpu'), backend='torch')
+    dummy = torch.zeros((1, IN_CHANNELS, patch_size, patch_size), dtype=torch.float32)
+
+    torch.onnx.export(
+        model,
+        dummy,
+        onnx_path,
+        input_names=['input'],
+        output_names=['logits'],
+        dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}},
+        opset_version=OPSET_VERSION,
+        dynamo=False,
+    )
+    print(f"Exported {checkpoint_path} to {onnx_path}")
+    return onnx_path
+
+
+def random_patches(num_patches=8, patch_size=PATCH_SIZE, seed=0):
+    """Generate HLS-like reflectance patches for when no real tile is at hand."""
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 5000, size=(num_patches, IN_CHANNELS, patch_size, patch_size), dtype=np.int16)
+
+
+def check_parity(patches, reference_path=DEFAULT_CHECKPOINT, candidate_path=DEFAULT_ONNX,
+                 candidate_backend='onnx', batch_size=4):
+    """Compare argmax masks of a candidate backend against the PyTorch reference."""
+    reference = get_model(reference_path, device=torch.device('cpu'), backend='torch')
+    candidate = get_model(candidate_path, backend=candidate_backend)
+
+    reference_masks = np.concatenate([m for _, m in predict_batches(reference, patches, batch_size=batch_size)])
+    candidate_masks = np.concatenate([m for _, m in predict_batches(candidate, patches, batch_size=batch_size)])
+
+    mismatched = int(np.count_nonzero(reference_masks != candidate_masks))
+    print(f"Parity {candidate_backend} vs torch: {mismatched} of {reference_masks.size} pixels differ")
+    return mismatched == 0, reference_masks, candidate_masks
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the crop UNet to ONNX and check parity with PyTorch.")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT)
+    parser.add_argument("--output", default=DEFAULT_ONNX)
+    parser.add_argument("--parity-patches", type=int, default=8,
+                        help="Number of random patches to compare (0 to skip the parity check)")
+    args = parser.parse_args()
+
+    export_onnx(args.checkpoint, args.output)
+    if args.parity_patches:
+        identical, _, _ = check_parity(random_patches(args.parity_patches), args.checkpoint, args.output)
+        if not identical:
+            raise SystemExit("ONNX masks differ from the PyTorch reference")
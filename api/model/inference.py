@@ -0,0 +1,71 @@
+import numpy as np
+import psutil
+import torch
+
+# Rough peak activation footprint of the UNet forward pass, in float32 feature
+# maps at input resolution (decoder1 holds enc1, the upconv output, their
+# concatenation and two conv outputs at once; coarser levels add ~1/4 each).
+ACTIVATION_CHANNELS = 512
+
+# Fraction of the free memory a batch is allowed to use
+MEMORY_FRACTION = 0.5
+
+MAX_BATCH_SIZE = 64
+
+
+def patch_memory(patch_shape):
+    """Estimated bytes one patch needs during a forward pass (input plus activations)."""
+    channels, height, width = patch_shape
+    return 4 * height * width * (channels + ACTIVATION_CHANNELS)
+
+
+def batch_size_for_budget(patch_shape, budget_bytes, max_batch_size=MAX_BATCH_SIZE):
+    """Largest batch size whose forward pass fits in budget_bytes."""
+    return max(1, min(int(budget_bytes) // patch_memory(patch_shape), max_batch_size))
+
+
+def auto_batch_size(patch_shape, device=None, memory_fraction=MEMORY_FRACTION, max_batch_size=MAX_BATCH_SIZE):
+    """Pick the largest batch size whose inputs and activations fit in the available memory."""
+    if device is not None and torch.device(device).type == 'cuda':
+        available, _ = torch.cuda.mem_get_info(torch.device(device))
+    else:
+        available = psutil.virtual_memory().available
+
+    return batch_size_for_budget(patch_shape, available * memory_fraction, max_batch_size)
+
+
+def forward_batches(model, patches, batch_size=None, device=None, scale=255.0, verbose=True):
+    """Run the model over patches in batches, yielding (start index, logits tensor on device).
+
+    Callers that run it many times per tile pass verbose=False and report progress themselves.
+    """
+    device = torch.device(device or 'cpu')
+    num_patches = len(patches)
+    patch_shape = tuple(patches[0].shape)
+
+    if batch_size is None:
+        batch_size = auto_batch_size(patch_shape, device=device)
+    batch_size = max(1, min(batch_size, num_patches))
+    if verbose:
+        print(f"Running inference on {num_patches} patches with batch size {batch_size}")
+
+    # Inputs are staged in one reusable float buffer; pinned so host-to-GPU copies can overlap
+    buffer = torch.empty((batch_size,) + patch_shape, dtype=torch.float32,
+                         pin_memory=device.type == 'cuda')
+
+    with torch.no_grad():
+        for start in range(0, num_patches, batch_size):
+            count = min(batch_size, num_patches - start)
+            batch = buffer[:count]
+            for j in range(count):
+                batch[j].copy_(torch.from_numpy(np.asarray(patches[start + j])))
+            batch.div_(scale)
+
+            yield start, model(batch.to(device, non_blocking=True))
+
+
+def predict_batches(model, patches, batch_size=None, device=None, scale=255.0):
+    """Run the model over patches in batches, yielding (start index, uint8 class masks)."""
+    for start, prediction in forward_batches(model, patches, batch_size, device, scale):
+        pred_masks = torch.argmax(prediction, dim=1).to(torch.uint8).cpu().numpy()  # (B, H, W)
+        yield start, pred_masks
@@ -0,0 +1,148 @@
+import argparse
+import glob
+import json
+import os
+
+import numpy as np
+import torch
+
+from api.model.registry import DEFAULT_CHECKPOINT, DEFAULT_ONNX, DEFAULT_INT8, OUT_CHANNELS, get_model
+from api.model.inference import predict_batches
+from api.model.export import export_onnx
+from api.util.patchifyTileForPrithvi import BAND_STACK_FILE, load_band_stack, patchifyTile
+
+
+class PatchCalibrationReader:
+    """Feeds patchified tile patches to the ONNX Runtime calibrator, one batch at a time."""
+
+    def __init__(self, patches, input_name='input', batch_size=8, scale=255.0):
+        self.batches = (
+            {input_name: np.asarray(patches[i:i + batch_size], dtype=np.float32) / scale}
+            for i in range(0, len(patches), batch_size)
+        )
+
+    def get_next(self):
+        return next(self.batches, None)
+
+
+def tile_files(tile_dir):
+    """List the band GeoTIFFs of a downloaded tile directory, in channel order when a band stack was recorded."""
+    if os.path.exists(os.path.join(tile_dir, BAND_STACK_FILE)):
+        return load_band_stack(tile_dir)
+    return sorted(glob.glob(os.path.join(tile_dir, '*.tif')))
+
+
+def sample_patches(tile_dirs, num_patches, seed=0):
+    """Patchify the tiles and draw a random subset of their patches."""
+    rng = np.random.default_rng(seed)
+    sampled = []
+    per_tile = max(1, num_patches // len(tile_dirs))
+    for tile_dir in tile_dirs:
+        patches, _ = patchifyTile(tile_files(tile_dir), save_to_disk=False)
+        indices = rng.choice(len(patches), size=min(per_tile, len(patches)), replace=False)
+        sampled.extend(np.asarray(patches[i]) for i in sorted(indices))
+    return np.stack(sampled)
+
+
+def quantize_int8(calibration_patches, onnx_path=DEFAULT_ONNX, int8_path=DEFAULT_INT8):
+    """Statically quantize the fp32 ONNX graph to int8, calibrating on real patches."""
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    prepared_path = onnx_path.replace('.onnx', '_prepared.onnx')
+    quant_pre_process(onnx_path, prepared_path)
+
+    quantize_static(
+        prepared_path,
+        int8_path,
+        PatchCalibrationReader(calibration_patches),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+        calibrate_method=CalibrationMethod.MinMax,
+    )
+    os.remove(prepared_path)
+    print(f"Quantized {onnx_path} to {int8_path}")
+    return int8_path
+
+
+def parity_report(fp32_masks, int8_masks, num_classes=OUT_CHANNELS):
+    """Per-class agreement and confusion shift of the int8 masks against the fp32 masks."""
+    confusion = np.bincount(
+        fp32_masks.ravel().astype(np.int64) * num_classes + int8_masks.ravel(),
+        minlength=num_classes * num_classes,
+    ).reshape(num_classes, num_classes)  # rows: fp32 class, columns: int8 class
+
+    fp32_counts = confusion.sum(axis=1)
+    int8_counts = confusion.sum(axis=0)
+    per_class = {}
+    for cls in range(num_classes):
+        if fp32_counts[cls] == 0 and int8_counts[cls] == 0:
+            continue
+        per_class[cls] = {
+            "fp32_pixels": int(fp32_counts[cls]),
+            "int8_pixels": int(int8_counts[cls]),
+            "agreement": float(confusion[cls, cls] / fp32_counts[cls]) if fp32_counts[cls] else 0.0,
+        }
+
+    off_diagonal = confusion - np.diag(np.diag(confusion))
+    shifts = [
+        {"from": int(i), "to": int(j), "pixels": int(off_diagonal[i, j])}
+        for i, j in zip(*np.nonzero(off_diagonal))
+    ]
+    shifts.sort(key=lambda shift: shift["pixels"], reverse=True)
+
+    return {
+        "overall_agreement": float(np.trace(confusion) / confusion.sum()),
+        "per_class": per_class,
+        "confusion_shift": shifts,
+        "confusion_matrix": confusion.tolist(),
+    }
+
+
+def evaluate_int8(heldout_dir, checkpoint_path=DEFAULT_CHECKPOINT, int8_path=DEFAULT_INT8, batch_size=8):
+    """Run the fp32 reference and the int8 model over a held-out tile and compare their masks."""
+    patches, _ = patchifyTile(tile_files(heldout_dir), save_to_disk=False)
+    reference = get_model(checkpoint_path, device=torch.device('cpu'), backend='torch')
+    quantized = get_model(int8_path, backend='int8')
+
+    fp32_masks = np.concatenate([m for _, m in predict_batches(reference, patches, batch_size=batch_size)])
+    int8_masks = np.concatenate([m for _, m in predict_batches(quantized, patches, batch_size=batch_size)])
+    return parity_report(fp32_masks, int8_masks)
+
+
+def print_report(report):
+    print(f"Overall agreement: {report['overall_agreement']:.4f}")
+    print("Class  fp32 px     int8 px     agreement")
+    for cls, stats in report["per_class"].items():
+        print(f"{cls:>5}  {stats['fp32_pixels']:>10}  {stats['int8_pixels']:>10}  {stats['agreement']:.4f}")
+    print("Largest confusion shifts (fp32 -> int8):")
+    for shift in report["confusion_shift"][:10]:
+        print(f"  {shift['from']:>2} -> {shift['to']:>2}: {shift['pixels']} px")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build an int8 UNet and report its parity with fp32.")
+    parser.add_argument("--calibration-tiles", nargs="+", required=True,
+                        help="Downloaded tile directories (18 band GeoTIFFs each) to calibrate on")
+    parser.add_argument("--heldout-tile", required=True,
+                        help="Tile directory not used for calibration, to compare fp32 and int8 masks on")
+    parser.add_argument("--num-calibration-patches", type=int, default=64)
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT)
+    parser.add_argument("--onnx", default=DEFAULT_ONNX)
+    parser.add_argument("--output", default=DEFAULT_INT8)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.onnx):
+        export_onnx(args.checkpoint, args.onnx)
+
+    calibration = sample_patches(args.calibration_tiles, args.num_calibration_patches)
+    quantize_int8(calibration, args.onnx, args.output)
+
+    report = evaluate_int8(args.heldout_tile, args.checkpoint, args.output)
+    print_report(report)
+    report_path = args.output.replace('.onnx', '_report.json')
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f"Saved parity report to: {report_path}")
@@ -0,0 +1,114 @@
+import os
+import threading
+
+import psutil
+import torch
+
+from api.model.model import UNet
+
+# Default checkpoint shipped next to this module, and the ONNX graph exported from it
+DEFAULT_CHECKPOINT = os.path.join(os.path.dirname(__file__), 'unet_best.pth')
+DEFAULT_ONNX = os.path.join(os.path.dirname(__file__), 'unet_best.onnx')
+DEFAULT_INT8 = os.path.join(os.path.dirname(__file__), 'unet_int8.onnx')
+
+# UNet configuration used by the crop classification pipeline (18 bands, 14 classes)
+IN_CHANNELS = 18
+OUT_CHANNELS = 14
+
+# Inference backends: eager PyTorch (the reference), ONNX Runtime on CPU,
+# and the post-training int8 quantized graph (also run through ONNX Runtime)
+BACKENDS = ('torch', 'onnx', 'int8')
+DEFAULT_BACKEND = os.environ.get('INFERENCE_BACKEND', 'torch')
+DEFAULT_PATHS = {
+    'torch': DEFAULT_CHECKPOINT,
+    'onnx': DEFAULT_ONNX,
+    'int8': DEFAULT_INT8,
+}
+
+# Process-wide cache of loaded models, keyed by (backend, model path, device)
+_models = {}
+_lock = threading.Lock()
+
+
+class OnnxUNet:
+    """ONNX Runtime CPU session that can be called like the PyTorch UNet."""
+
+    def __init__(self, onnx_path, intra_op_threads=None, inter_op_threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # A single graph is run per call, so parallelism comes from inside each op;
+        # physical cores avoid hyperthreads fighting over the same FPUs.
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = intra_op_threads or int(
+            os.environ.get('ORT_INTRA_OP_THREADS', psutil.cpu_count(logical=False) or 1))
+        options.inter_op_num_threads = inter_op_threads or int(os.environ.get('ORT_INTER_OP_THREADS', 1))
+
+        self.onnx_path = onnx_path
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, x):
+        inputs = x.detach().cpu().numpy()
+        logits = self.session.run(None, {self.input_name: inputs})[0]
+        return torch.from_numpy(logits)
+
+
+def get_device(backend=None):
+    """Return the device inference should run on (ONNX Runtime backends run on the CPU)."""
+    if (backend or DEFAULT_BACKEND) != 'torch':
+        return torch.device('cpu')
+    return torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+
+def _load_model(backend, model_path, device):
+    if backend == 'torch':
+        model = UNet(in_channels=IN_CHANNELS, out_channels=OUT_CHANNELS)
+        model.load_state_dict(torch.load(model_path, map_location=device))
+        model.to(device)
+        model.eval()
+        return model
+    if backend == 'onnx':
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"{model_path} not found, export it with `python -m api.model.export`")
+        return OnnxUNet(model_path)
+    if backend == 'int8':
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"{model_path} not found, build it with `python -m api.model.quantize`")
+        return OnnxUNet(model_path)
+    raise ValueError(f"Unknown inference backend {backend!r}, expected one of {BACKENDS}")
+
+
+def get_model(checkpoint_path=None, device=None, backend=None):
+    """Return a warm, eval-mode model for the backend, loading it only on first use."""
+    backend = backend or DEFAULT_BACKEND
+    checkpoint_path = checkpoint_path or DEFAULT_PATHS.get(backend, DEFAULT_CHECKPOINT)
+    # ONNX Runtime sessions here only use the CPU execution provider
+    device = torch.device('cpu') if backend != 'torch' else (device or get_device(backend))
+    key = (backend, os.path.abspath(checkpoint_path), str(device))
+
+    model = _models.get(key)
+    if model is not None:
+        return model
+
+    with _lock:
+        # Another thread may have finished loading while we waited on the lock
+        model = _models.get(key)
+        if model is None:
+            model = _load_model(backend, checkpoint_path, device)
+            _models[key] = model
+            print(f"Model loaded from {checkpoint_path} ({backend})")
+    return model
+
+
+def preload_models(checkpoint_paths=(None,), device=None, backend=None):
+    """Load the given checkpoints up front, e.g. at server startup."""
+    for checkpoint_path in checkpoint_paths:
+        get_model(checkpoint_path, device=device, backend=backend)
+
+
+def clear_models():
+    """Drop all cached models so the next call reloads them from disk."""
+    with _lock:
+        _models.clear()
@@ -1,8 +1,11 @@
-from flask import Blueprint, jsonify, request, send_from_directory, abort
+from flask import Blueprint, Response, jsonify, request, send_from_directory, abort
 import os
 import json
 from pyproj import Transformer
-# from ..util.createOutputMap import create_map  # Assuming create_map is in a separate module
+
+from ..util.rasterTiles import RasterTiles, MAX_ZOOM as RASTER_MAX_ZOOM
+from ..util.tileMath import valid_tile
+from ..util.jobQueue import get_job_queue
 
 # Create a blueprint for the map endpoints
 map_bp = Blueprint('map', __name__, url_prefix='/map')
@@ -10,6 +13,9 @@ map_bp = Blueprint('map', __name__, url_prefix='/map')
 # Path to the mapdata folder
 MAPDATA_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'mapdata')
 
+# Web mercator PNG tiles rendered from the classification TIFFs of each run
+raster_tiles = RasterTiles(MAPDATA_FOLDER)
+
 # Route to list timestamps (folders inside mapdata)
 @map_bp.route('/timestamps', methods=['GET'])
 def get_timestamps():
@@ -51,32 +57,44 @@ def serve_mapdata(filepath):
     except FileNotFoundError:
         abort(404, description="File not found")
 
-# Route to generate a tile with the given bounding box and fixed temporal range
-# @map_bp.route('/generate', methods=['POST'])
-# def generate_tile():
-#     # try:
-#     # Get the bounding box from the request body
-#     bbox = request.json.get('bounding_box')
-#     if not bbox or len(bbox) != 4:
-#         return jsonify({"error": "bounding_box parameter is required and should contain four values"}), 400
-
-#     # Convert bounding box from WGS84 (EPSG:4326) to EPSG:32643
-#     # transformer = Transformer.from_crs("EPSG:4326", "EPSG:32643", always_xy=True)
-#     # minx, miny = transformer.transform(bbox[0], bbox[1])
-#     # maxx, maxy = transformer.transform(bbox[2], bbox[3])
+# Route to serve a run's classification as XYZ PNG tiles, instead of whole stitched PNGs
+@map_bp.route('/tiles/<timestamp>/<int:z>/<int:x>/<int:y>.png', methods=['GET'])
+def get_raster_tile(timestamp, z, x, y):
+    if not valid_tile(z, x, y, RASTER_MAX_ZOOM):
+        return jsonify({"error": "Tile out of range"}), 404
 
-#     # Prepare the bounding box in EPSG:32643 format
-#     # transformed_bbox = [minx, miny, maxx, maxy]
-
-#     # Temporal range (fixed for this example)
-#     temporal_range = ("2023-04-01", "2023-12-01")
+    try:
+        data = raster_tiles.tile(timestamp, z, x, y)
+    except FileNotFoundError:
+        return jsonify({"error": "Timestamp folder not found"}), 404
 
-#     # Call the create_map function to generate the tile
-#     output_png, output_json = create_map(bbox, temporal_range)
+    # A run's outputs do not change once written; cached tiles are keyed by the run directory's mtime
+    return Response(data, mimetype='image/png', headers={"Cache-Control": "public, max-age=3600"})
 
-#     # Return the tile name (using the folder name created by create_map)
-#     tile_name = os.path.basename(os.path.dirname(output_png))
-#     return jsonify({"tile_name": tile_name, "output_png": output_png, "output_json": output_json})
+# Route to queue map generation for the given bounding box; returns a job ID straight away
+@map_bp.route('/generate', methods=['POST'])
+def generate_tile():
+    try:
+        # Get the bounding box (minx, miny, maxx, maxy in WGS84) from the request body
+        bbox = request.json.get('bounding_box')
+        if not bbox or len(bbox) != 4:
+            return jsonify({"error": "bounding_box parameter is required and should contain four values"}), 400
+
+        # Temporal range, defaulting to the fixed season used so far
+        temporal_range = list(request.json.get('temporal_range') or ("2023-04-01", "2023-12-01"))
+
+        job_id, created = get_job_queue().submit('bbox_map', {
+            "bounding_box": [float(v) for v in bbox],
+            "temporal_range": temporal_range,
+        })
+        return jsonify({"job_id": job_id, "deduplicated": not created}), 202
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-#     # except Exception as e:
-#         # return jsonify({"error": str(e)}), 500
+# Route to get the status and per-stage progress of a map generation job
+@map_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
@@ -0,0 +1,23 @@
+from flask import Blueprint, Response, jsonify
+
+from api.util.vectorTiles import boundary_tiles, BOUNDARY_LEVELS, MAX_ZOOM, MVT_MIME_TYPE
+from api.util.tileMath import valid_tile
+
+# Create a blueprint for the vector tile endpoints
+tiles_bp = Blueprint('tiles', __name__, url_prefix='/tiles')
+
+# Route to serve administrative boundaries as Mapbox Vector Tiles, one layer named after the level
+@tiles_bp.route('/boundaries/<level>/<int:z>/<int:x>/<int:y>.pbf', methods=['GET'])
+def get_boundary_tile(level, z, x, y):
+    if level not in BOUNDARY_LEVELS:
+        return jsonify({"error": f"Unknown level {level!r}, expected one of {list(BOUNDARY_LEVELS)}"}), 404
+    if not valid_tile(z, x, y, MAX_ZOOM):
+        return jsonify({"error": "Tile out of range"}), 404
+
+    try:
+        data = boundary_tiles.tile(level, z, x, y)
+    except FileNotFoundError:
+        return jsonify({"error": f"{BOUNDARY_LEVELS[level]} not found"}), 404
+
+    # Boundaries change rarely; cached tiles are keyed by the source file version
+    return Response(data, mimetype=MVT_MIME_TYPE, headers={"Cache-Control": "public, max-age=86400"})
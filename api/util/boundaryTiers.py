@@ -0,0 +1,122 @@
+import os
+import sys
+import json
+
+import shapely
+from shapely.geometry import Polygon, MultiPolygon, mapping
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+from api.util.geojsonCache import ROOT_DIR, GEOJSON_LEVELS, SIMPLIFY_TIERS, TIERS_DIR, SOURCE_HASH_KEY, tier_path
+from api.util.fileHash import file_sha256
+
+
+def repair_geometry(geom):
+    """Shapely geometry of a GeoJSON (Multi)Polygon, without the broken parts the GADM files contain.
+
+    remove_invalid_districts.py drops any feature with a two-point ring,
+    which loses whole districts (and the Sindh and Baluchistan provinces)
+    over a few degenerate islands. Here only those rings are dropped, and
+    Polygons mislabelled as MultiPolygon are read as Polygons. Returns None
+    if nothing valid is left.
+    """
+    coords = geom.get("coordinates") or []
+    if geom.get("type") == "Polygon" or (coords and coords[0] and isinstance(coords[0][0][0], (int, float))):
+        polygons = [coords]
+    elif geom.get("type") == "MultiPolygon":
+        polygons = coords
+    else:
+        return None
+
+    parts = []
+    for rings in polygons:
+        if not rings or len(rings[0]) < 4:
+            continue
+        parts.append(Polygon(rings[0], [hole for hole in rings[1:] if len(hole) >= 4]))
+    if not parts:
+        return None
+    geometry = shapely.make_valid(parts[0] if geom["type"] == "Polygon" else MultiPolygon(parts))
+    if geometry.geom_type == "GeometryCollection":
+        # Repairs can split off stray lines and points; keep the area
+        polygons = [p for g in shapely.get_parts(geometry) for p in shapely.get_parts(g) if p.geom_type == "Polygon"]
+        geometry = MultiPolygon(polygons) if polygons else None
+    return geometry
+
+
+def load_features(path):
+    """Features of a boundary GeoJSON with their repaired shapely geometries."""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    features, geometries = [], []
+    for feature in data["features"]:
+        geometry = repair_geometry(feature["geometry"]) if feature.get("geometry") else None
+        if geometry is None or geometry.is_empty:
+            continue
+        features.append(feature)
+        geometries.append(geometry)
+    print(f"Loaded {len(features)} of {len(data['features'])} features from {path}")
+    return features, geometries
+
+
+def simplify_geometries(geometries, tolerance):
+    """Simplify polygons without breaking their topology.
+
+    A clean coverage is simplified as a whole, so neighbours keep sharing
+    their edges. The GADM files have gaps and overlaps along many borders,
+    which leaves coverage simplification almost no shared edges to work
+    with; those are simplified feature by feature, preserving each one's
+    own topology.
+    """
+    if shapely.coverage_is_valid(geometries):
+        return shapely.coverage_simplify(geometries, tolerance)
+    return shapely.simplify(geometries, tolerance, preserve_topology=True)
+
+
+def quantize_coords(coords, decimals):
+    if coords and isinstance(coords[0], (list, tuple)):
+        return [quantize_coords(c, decimals) for c in coords]
+    return [round(v, decimals) for v in coords]
+
+
+def build_tier(features, geometries, tolerance, decimals):
+    """A FeatureCollection of the features simplified to tolerance, coordinates rounded to decimals."""
+    simplified = simplify_geometries(geometries, tolerance)
+    # Snap to the output grid first, so rounding cannot make rings self-intersect or collapse
+    simplified = shapely.set_precision(simplified, 10 ** -decimals)
+
+    out_features = []
+    for feature, geometry in zip(features, simplified):
+        if geometry.is_empty:
+            continue
+        geom = mapping(geometry)
+        out_features.append({
+            "type": "Feature",
+            "properties": feature["properties"],
+            "geometry": {"type": geom["type"], "coordinates": quantize_coords(geom["coordinates"], decimals)},
+        })
+    return {"type": "FeatureCollection", "features": out_features}
+
+
+def build_level_tiers(level, tiers=SIMPLIFY_TIERS, root_dir=ROOT_DIR, tiers_dir=TIERS_DIR):
+    """Write every simplification tier of a /api/geojson level to tiers_dir, stamped with its source's hash."""
+    source = os.path.join(root_dir, GEOJSON_LEVELS[level][0])
+    source_sha256 = file_sha256(source)
+    features, geometries = load_features(source)
+    os.makedirs(tiers_dir, exist_ok=True)
+
+    paths = []
+    for max_zoom, tolerance, decimals in tiers:
+        collection = build_tier(features, geometries, tolerance, decimals)
+        collection[SOURCE_HASH_KEY] = source_sha256
+        path = tier_path(level, max_zoom, tiers_dir)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(collection, f, ensure_ascii=False, separators=(',', ':'))
+        print(f"  z<={max_zoom}: tolerance {tolerance}, {decimals} decimals -> {path} ({os.path.getsize(path)} bytes)")
+        paths.append(path)
+    return paths
+
+
+if __name__ == "__main__":
+    # Rebuild after replacing or re-cleaning any of the boundary files
+    for level in GEOJSON_LEVELS:
+        build_level_tiers(level)
@@ -0,0 +1,69 @@
+import os
+import warnings
+
+import rasterio
+from rasterio.errors import NotGeoreferencedWarning
+from rasterio.shutil import copy as copy_dataset
+
+# Class rasters are uint8 with 255 outside the tile
+NODATA = 255
+
+# Internal tile size; overviews are added until the smallest fits in one block
+BLOCK_SIZE = 512
+
+# Class values must never be averaged: overviews keep the majority class (mode) or a sampled pixel (nearest)
+OVERVIEW_RESAMPLINGS = ('mode', 'nearest')
+OVERVIEW_RESAMPLING = os.environ.get('COG_OVERVIEW_RESAMPLING', 'mode')
+
+
+def cog_options(resampling=OVERVIEW_RESAMPLING, blocksize=BLOCK_SIZE):
+    """Creation options of the GDAL COG driver for a single-band class raster."""
+    if resampling not in OVERVIEW_RESAMPLINGS:
+        raise ValueError(f"Unknown overview resampling {resampling!r}, expected one of {list(OVERVIEW_RESAMPLINGS)}")
+    return {
+        "BLOCKSIZE": blocksize,
+        "COMPRESS": "DEFLATE",
+        "OVERVIEW_RESAMPLING": resampling.upper(),
+        "OVERVIEW_COMPRESS": "DEFLATE",
+        "NUM_THREADS": "ALL_CPUS",
+    }
+
+
+def write_cog(path, classes, crs=None, transform=None, nodata=NODATA, resampling=OVERVIEW_RESAMPLING,
+              blocksize=BLOCK_SIZE):
+    """Write a class raster as a Cloud-Optimized GeoTIFF.
+
+    The output is tiled and DEFLATE-compressed, with internal overviews
+    and an explicit nodata value, so readers can fetch single blocks and
+    zoom levels. The COG driver can only copy an existing dataset, so the
+    raster goes through a temporary tiled GTiff next to path. Without crs
+    and transform the COG is written without georeferencing.
+    """
+    profile = {
+        "driver": "GTiff",
+        "height": classes.shape[0],
+        "width": classes.shape[1],
+        "count": 1,
+        "dtype": "uint8",
+        "nodata": nodata,
+        "tiled": True,
+        "blockxsize": blocksize,
+        "blockysize": blocksize,
+    }
+    if crs is not None:
+        profile["crs"] = crs
+    if transform is not None:
+        profile["transform"] = transform
+
+    tmp_path = f"{path}.part.tif"
+    try:
+        with warnings.catch_warnings():
+            if transform is None:
+                warnings.simplefilter("ignore", NotGeoreferencedWarning)
+            with rasterio.open(tmp_path, 'w', **profile) as dst:
+                dst.write(classes, 1)
+            copy_dataset(tmp_path, path, driver="COG", **cog_options(resampling, blocksize))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
@@ -0,0 +1,94 @@
+import warnings
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+from api.util.sceneSelection import FMASK_INVALID_BITS, FMASK_FILL
+
+COMPOSITE_METHODS = ('best', 'median')
+
+# HLS surface reflectance fill value
+HLS_NODATA = -9999
+
+# Rows composited at a time; memory is scenes x bands x BLOCK_ROWS x width values
+BLOCK_ROWS = 256
+
+
+def clear_pixels(fmask, data):
+    """(N, h, w) mask of usable observations: data present and, with an Fmask, no cloud or shadow."""
+    valid = np.all(data != HLS_NODATA, axis=1)
+    if fmask is not None:
+        valid &= ((fmask & FMASK_INVALID_BITS) == 0) & (fmask != FMASK_FILL)
+    return valid
+
+
+def composite_block(data, clear, method='best'):
+    """Composite an (N, B, h, w) block of N scenes into (B, h, w).
+
+    'best' takes each pixel from the first scene (in the given order) with a
+    clear observation; 'median' takes the per-band median of all clear
+    observations. Pixels no scene sees clearly fall back to the first scene
+    with any data, and stay HLS_NODATA if there is none.
+    """
+    present = np.all(data != HLS_NODATA, axis=1)
+    fallback = np.argmax(present, axis=0)
+    first_clear = np.argmax(clear, axis=0)
+    any_clear = clear.any(axis=0)
+    chosen = np.where(any_clear, first_clear, fallback)
+    result = np.take_along_axis(data, chosen[None, None], axis=0)[0]
+
+    if method == 'median':
+        values = np.where(clear[:, None], data, np.nan).astype(np.float32)
+        with warnings.catch_warnings():
+            # Pixels without any clear observation are all-NaN; they are replaced below
+            warnings.simplefilter('ignore', RuntimeWarning)
+            median = np.nanmedian(values, axis=0)
+        result = np.where(any_clear[None], np.round(median), result).astype(data.dtype)
+    elif method != 'best':
+        raise ValueError(f"Unknown composite method {method!r}, expected one of {COMPOSITE_METHODS}")
+
+    result[:, ~present.any(axis=0)] = HLS_NODATA
+    return result
+
+
+def composite_scenes(scene_band_files, output_paths, fmask_files=None, method='best', block_rows=BLOCK_ROWS):
+    """Composite N scenes band by band into one GeoTIFF per band.
+
+    scene_band_files[n] lists scene n's band files, in the order of
+    output_paths; fmask_files[n] is its Fmask file or None. Scenes are read
+    block by block, all bands of a scene per block, so memory stays bounded
+    however many scenes a window holds.
+    """
+    fmask_files = fmask_files or [None] * len(scene_band_files)
+    bands = [[rasterio.open(path) for path in files] for files in scene_band_files]
+    fmasks = [rasterio.open(path) if path else None for path in fmask_files]
+    try:
+        first = bands[0][0]
+        height, width = first.height, first.width
+        profile = first.profile.copy()
+        profile.update(count=1, nodata=HLS_NODATA)
+
+        outputs = [rasterio.open(path, 'w', **profile) for path in output_paths]
+        try:
+            for row in range(0, height, block_rows):
+                window = Window(0, row, width, min(block_rows, height - row))
+                data = np.stack([
+                    np.stack([dataset.read(1, window=window) for dataset in scene]) for scene in bands
+                ])
+                if all(fmask is not None for fmask in fmasks):
+                    fmask = np.stack([dataset.read(1, window=window) for dataset in fmasks])
+                else:
+                    fmask = None
+                result = composite_block(data, clear_pixels(fmask, data), method)
+                for output, band in zip(outputs, result):
+                    output.write(band, 1, window=window)
+        finally:
+            for output in outputs:
+                output.close()
+    finally:
+        for dataset in [d for scene in bands for d in scene] + [f for f in fmasks if f]:
+            dataset.close()
+
+    print(f"Composited {len(scene_band_files)} scenes ({method}) into {len(output_paths)} bands")
+    return output_paths
@@ -6,12 +6,33 @@ import shutil
 from shutil import move
 import sys
 import traceback
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
 
-from api.util.downloadTileEarthAccess import downloadTile, getTileBoundsInWGS84, search_hls_data
+from api.util.downloadTileEarthAccess import downloadTile, getTileBoundsInWGS84
+from api.util.sceneIndex import search_scene_index
+from api.util.sceneSelection import select_province_timestamps
 from api.util.patchifyTileForPrithvi import patchifyTile
 from api.util.createMasks import createMasks
 from api.util.stitch256masks import stitch256masks
+from api.util.tileInference import infer_tile_files, NODATA
+from api.util.palette import CLASS_COLORS, write_paletted_png
+from api.util.fileHash import file_sha256
+from api.util.runManifest import (RunManifest, tile_key, find_reusable_tile, copy_artifacts,
+                                  RUNNING, DONE, FAILED)
+from api.model.registry import get_model, get_device, DEFAULT_PATHS, DEFAULT_BACKEND
+
+MAPDATA_DIR = "/home/umer/projects/vector_studio/icons/cropmapping-server-two/mapdata"
+
+# Each run gets a directory here and each of its tiles a workspace inside it,
+# so neither concurrent tiles nor concurrent runs share scratch files
+JOBS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'tempData', 'jobs')
+
+# Concurrency per stage: downloads are network bound, compute (patchify,
+# inference, stitching) is CPU/GPU bound and each worker holds a model copy
+DOWNLOAD_WORKERS = int(os.environ.get('TILE_DOWNLOAD_WORKERS', 4))
+COMPUTE_WORKERS = int(os.environ.get('TILE_COMPUTE_WORKERS', 1))
 
 def generate_random_name(length=8):
     """Generate a random name of fixed length."""
@@ -36,79 +57,102 @@ def clear_directory(directory_path):
         elif os.path.isdir(item_path):
             shutil.rmtree(item_path)
 
-def filter_results_by_tile(results, tile_name):
-    """Filter results that contain the specified tile name in data links."""
-    filtered_results = []
-    for result in results:
-        for file_url in result.data_links():
-            if tile_name in file_url:
-                filtered_results.append(result)
-                break  # Found a match, no need to check other links
-    return filtered_results
-
-def create_single_map(results, tile_name, timestamps, output_dir):
-    # Clear the tiles directory before processing
-    tiles_dir = '/home/umer/projects/vector_studio/icons/cropmapping-server-two/tempData/tiles'
-    clear_directory(tiles_dir)
-    
+def workspace_path(run_name, tile_name, jobs_dir=JOBS_DIR):
+    return os.path.join(jobs_dir, run_name, tile_name)
+
+def tile_workspace(tile_name, run_name, jobs_dir=JOBS_DIR):
+    """Empty scratch directory for one tile of one run, so tiles and runs can be processed at once.
+
+    Two runs covering the same MGRS tile (another season, a neighbouring
+    province) get separate workspaces, so neither clears the other's files.
+    """
+    workspace = workspace_path(run_name, tile_name, jobs_dir)
+    os.makedirs(workspace, exist_ok=True)
+    clear_directory(workspace)
+    for stage_dir in ('tiles', 'patches_masks', 'finalOutput'):
+        os.makedirs(os.path.join(workspace, stage_dir))
+    return workspace
+
+def download_tile_stage(scene_index, tile_name, timestamps, workspace):
+    """Step 1: download the band stack of one tile into its workspace."""
     print(tile_name, timestamps)
-    # return None, None, None
-    # Step 1: Download the tiles for this specific tile name
-    tiles_dir, tiff_files = downloadTile(None, None, tile_name=tile_name, filtered_results=results, timestamps=timestamps)
+    tiles_dir, tiff_files = downloadTile(None, None, tile_name=tile_name, scene_index=scene_index,
+                                         timestamps=timestamps, output_dir=os.path.join(workspace, 'tiles'))
     if not tiles_dir or not tiff_files:
         print(f"Failed to download tiles for {tile_name}")
-        return None, None, None
+        return None
     print(f"Tiles for {tile_name} downloaded to: {tiles_dir}")
-    
-    # directory = '/home/umer/projects/vector_studio/icons/cropmapping-server-two/tempData/tiles'
-    # List all files and directories
-    directory = tiles_dir
-    tiff_files = os.listdir(directory)
-    tiff_files = [(directory + "/" + t) for t in tiff_files]
-    
+
+    # tiff_files is the band stack returned by downloadTile: one file per
+    # model channel, with a single scene listed once per time step
+    return tiff_files
+
+def create_single_map(scene_index, tile_name, timestamps, output_dir, sliding_window=False, workspace=None):
+    # A workspace made here is private to this call and removed when it returns
+    own_workspace = workspace is None
+    workspace = workspace or tile_workspace(tile_name, generate_random_name())
+    try:
+        tiff_files = download_tile_stage(scene_index, tile_name, timestamps, workspace)
+        if not tiff_files:
+            return None, None, None
+        return process_tile_stage(tile_name, tiff_files, workspace, output_dir, sliding_window)
+    finally:
+        if own_workspace:
+            shutil.rmtree(os.path.dirname(workspace), ignore_errors=True)
+
+def process_tile_stage(tile_name, tiff_files, workspace, output_dir, sliding_window=False):
+    """Steps 2-6: classify a downloaded tile and write its PNG, class TIFF and metadata to output_dir."""
     if not tiff_files:
         print(f"No files found for tile {tile_name}")
         return None, None, None
     
     # Extract the tile name from the first file
-    extracted_tile_name = get_tile_name(tiff_files[0])
+    extracted_tile_name = get_tile_name(os.path.basename(tiff_files[0]))
     print(f"Tile name: {extracted_tile_name}")
 
-    # Step 2: Patchify the tiles - use memory approach
-    patches, profile = patchifyTile(tiff_files, save_to_disk=False)
-    print("Patches generated in memory with shape:", patches.shape)
+    if sliding_window:
+        # Steps 2-4: Classify the whole tile with overlapping, blended windows
+        new_tiff_path = os.path.join(output_dir, f"stitched_tile_{tile_name}.tiff")
+        classes, _ = infer_tile_files(tiff_files, get_model(), new_tiff_path, device=get_device())
+        new_png_path = os.path.join(output_dir, f"stitched_tile_{tile_name}.png")
+        write_paletted_png(new_png_path, classes, CLASS_COLORS, nodata=NODATA)
+        print(f"Saved classified tile to: {new_png_path}")
+    else:
+        # Step 2: Patchify the tiles - use memory approach, padding the edges so the whole tile is covered
+        patches, profile = patchifyTile(tiff_files, save_to_disk=False, pad_edges=True)
+        print("Patches generated in memory with shape:", patches.shape)
     
-    # For compatibility, still create the directory
-    patches_dir = "tempData/patches"
-    os.makedirs(patches_dir, exist_ok=True)
-
-    # Step 3: Generate masks directly from patches in memory and get them back
-    masks_dir, rgb_masks, class_masks = createMasks(input_patches=patches, profile=profile, return_memory_masks=True)
-    print("Masks processed with", len(rgb_masks), "RGB masks and", len(class_masks), "class masks")
+        # Step 3: Generate masks directly from patches in memory and get them back
+        masks_dir, rgb_masks, class_masks = createMasks(input_patches=patches, profile=profile, return_memory_masks=True,
+                                                        save_dir=os.path.join(workspace, 'patches_masks'))
+        print("Masks processed with", len(rgb_masks), "RGB masks and", len(class_masks), "class masks")
 
-    # Step 4: Stitch the masks directly from memory
-    output_png = stitch256masks(rgb_masks=rgb_masks, class_masks=class_masks)
-    print(f"Stitched mask output: {output_png}")
+        # Step 4: Stitch the masks directly from memory
+        output_png = stitch256masks(rgb_masks=rgb_masks, class_masks=class_masks,
+                                    coords=patches.coords, tile_shape=patches.tile_shape,
+                                    output_file=os.path.join(workspace, 'finalOutput', 'stitched_image.png'),
+                                    source_tiff=tiff_files[0])
+        print(f"Stitched mask output: {output_png}")
     
-    # Get the stitched TIFF path
-    output_tiff = output_png.replace('.png', '.tiff')
-    if os.path.exists(output_tiff):
-        print(f"Stitched TIFF output: {output_tiff}")
-    else:
-        print(f"Warning: Expected TIFF file not found at {output_tiff}")
-        output_tiff = None
+        # Get the stitched TIFF path
+        output_tiff = output_png.replace('.png', '.tiff')
+        if os.path.exists(output_tiff):
+            print(f"Stitched TIFF output: {output_tiff}")
+        else:
+            print(f"Warning: Expected TIFF file not found at {output_tiff}")
+            output_tiff = None
 
-    # Move the stitched PNG to the output folder
-    new_png_path = os.path.join(output_dir, f"stitched_tile_{tile_name}.png")
-    move(output_png, new_png_path)
-    print(f"Moved stitched tile to: {new_png_path}")
+        # Move the stitched PNG to the output folder
+        new_png_path = os.path.join(output_dir, f"stitched_tile_{tile_name}.png")
+        move(output_png, new_png_path)
+        print(f"Moved stitched tile to: {new_png_path}")
     
-    # Move the stitched TIFF if it exists
-    new_tiff_path = None
-    if output_tiff and os.path.exists(output_tiff):
-        new_tiff_path = os.path.join(output_dir, f"stitched_tile_{tile_name}.tiff")
-        move(output_tiff, new_tiff_path)
-        print(f"Moved stitched class TIFF to: {new_tiff_path}")
+        # Move the stitched TIFF if it exists
+        new_tiff_path = None
+        if output_tiff and os.path.exists(output_tiff):
+            new_tiff_path = os.path.join(output_dir, f"stitched_tile_{tile_name}.tiff")
+            move(output_tiff, new_tiff_path)
+            print(f"Moved stitched class TIFF to: {new_tiff_path}")
 
     # Step 5: Get the bounds for the tile
     miny, maxy, maxx, minx = getTileBoundsInWGS84(tiff_files[0])
@@ -141,8 +185,145 @@ def create_single_map(results, tile_name, timestamps, output_dir):
 
     return new_png_path, new_tiff_path, json_path
 
-def create_large_output_map(bounding_box, temporal_range):
-    """Create maps for multiple tiles in a single operation."""
+def tile_result(manifest, tile_name):
+    """(png_path, tiff_path, json_path, tiff_files) of a finished tile, from its manifest entry."""
+    artifacts = manifest.tile(tile_name)["artifacts"]
+    def output_path(name):
+        return os.path.join(manifest.output_dir, artifacts[name]) if artifacts.get(name) else None
+    return output_path('png_file'), output_path('tiff_file'), output_path('json_file'), artifacts.get('source_tiffs', [])
+
+def process_tiles(scene_index, tiles, timestamps, output_dir, sliding_window=False,
+                  download_workers=DOWNLOAD_WORKERS, compute_workers=COMPUTE_WORKERS, manifest=None, run_name=None,
+                  jobs_dir=JOBS_DIR):
+    """Run the per-tile pipeline over many tiles, overlapping downloads with computation.
+
+    Downloads are network bound and run on a thread pool; patchify, inference
+    and stitching of each downloaded tile run in a pool of worker processes,
+    each keeping its own cached model. Every tile works in its own workspace
+    under jobs_dir/<run_name> (by default the name of output_dir), which is
+    removed once the tile finishes. With a manifest, tiles already finished for the same inputs and model,
+    in this run or any other run under MAPDATA_DIR, are not processed again,
+    and a tile whose download finished but whose processing failed keeps its
+    workspace for the next attempt.
+    Returns {tile_name: (png_path, tiff_path, json_path, tiff_files)} for
+    the tiles that completed.
+    """
+    results = {}
+    downloads = {}
+    computations = {}
+    keys = {}
+    model_sha256 = file_sha256(DEFAULT_PATHS[DEFAULT_BACKEND]) if manifest else None
+    run_name = run_name or os.path.basename(os.path.normpath(output_dir))
+    run_jobs_dir = os.path.join(jobs_dir, run_name)
+
+    def submit_compute(tile_name, tiff_files, workspace):
+        if manifest:
+            manifest.set_stage(tile_name, 'process', RUNNING)
+        future = compute_pool.submit(process_tile_stage, tile_name, tiff_files, workspace, output_dir, sliding_window)
+        computations[future] = (tile_name, tiff_files, workspace)
+
+    # spawn, as CUDA cannot be used in forked workers
+    context = multiprocessing.get_context('spawn')
+    with ThreadPoolExecutor(max_workers=download_workers) as download_pool, \
+            ProcessPoolExecutor(max_workers=compute_workers, mp_context=context) as compute_pool:
+        for i, tile_name in enumerate(tiles):
+            # Filter results for this specific tile
+            tile_index = scene_index.subset(tile_name)
+            if not tile_index:
+                print(f"No results found for tile {tile_name}")
+                continue
+
+            workspace = workspace_path(run_name, tile_name, jobs_dir)
+            if manifest:
+                scene_ids = tile_index.scene_ids(timestamps[i])
+                key = keys[tile_name] = tile_key(scene_ids, timestamps[i], model_sha256, sliding_window)
+                manifest.start_tile(tile_name, key, scene_ids, timestamps[i])
+
+                if manifest.completed(tile_name, key):
+                    print(f"Tile {tile_name} already finished in this run, skipping")
+                    results[tile_name] = tile_result(manifest, tile_name)
+                    continue
+
+                run_dir, entry = find_reusable_tile(key, MAPDATA_DIR, exclude_dir=output_dir)
+                if entry:
+                    print(f"Reusing tile {tile_name} from {run_dir}")
+                    copy_artifacts(entry, run_dir, output_dir)
+                    manifest.set_artifacts(tile_name, **entry["artifacts"])
+                    manifest.set_stage(tile_name, 'download', DONE)
+                    manifest.set_stage(tile_name, 'process', DONE)
+                    results[tile_name] = tile_result(manifest, tile_name)
+                    continue
+
+                tiff_files = manifest.tile(tile_name)["artifacts"].get('source_tiffs')
+                if manifest.stage_done(tile_name, 'download', key) and tiff_files and all(map(os.path.exists, tiff_files)):
+                    print(f"Tile {tile_name} already downloaded, skipping to processing")
+                    submit_compute(tile_name, tiff_files, workspace)
+                    continue
+
+                manifest.set_stage(tile_name, 'download', RUNNING)
+
+            workspace = tile_workspace(tile_name, run_name, jobs_dir)
+            future = download_pool.submit(download_tile_stage, tile_index, tile_name, timestamps[i], workspace)
+            downloads[future] = (tile_name, workspace)
+
+        # Hand each tile to the compute pool as soon as its download finishes
+        for future in as_completed(downloads):
+            tile_name, workspace = downloads[future]
+            try:
+                tiff_files = future.result()
+            except Exception as e:
+                print(f"Error downloading tile {tile_name}: {str(e)}")
+                print(traceback.format_exc())
+                if manifest:
+                    manifest.set_stage(tile_name, 'download', FAILED, error=str(e))
+                shutil.rmtree(workspace, ignore_errors=True)
+                continue
+            if not tiff_files:
+                if manifest:
+                    manifest.set_stage(tile_name, 'download', FAILED, error="No files downloaded")
+                shutil.rmtree(workspace, ignore_errors=True)
+                continue
+            if manifest:
+                manifest.set_artifacts(tile_name, source_tiffs=tiff_files)
+                manifest.set_stage(tile_name, 'download', DONE)
+            submit_compute(tile_name, tiff_files, workspace)
+
+        for done, future in enumerate(as_completed(computations), start=1):
+            tile_name, tiff_files, workspace = computations[future]
+            try:
+                png_path, tiff_path, json_path = future.result()
+                results[tile_name] = (png_path, tiff_path, json_path, tiff_files)
+                print(f"Finished tile {tile_name}", done, "of", len(computations))
+                if manifest:
+                    manifest.set_artifacts(tile_name,
+                                           png_file=os.path.basename(png_path) if png_path else None,
+                                           tiff_file=os.path.basename(tiff_path) if tiff_path else None,
+                                           json_file=os.path.basename(json_path) if json_path else None)
+                    manifest.set_stage(tile_name, 'process', DONE if png_path and json_path else FAILED)
+                shutil.rmtree(workspace, ignore_errors=True)
+            except Exception as e:
+                print(f"Error processing tile {tile_name}: {str(e)}")
+                print(traceback.format_exc())
+                print(f"Continuing with the next tile...")
+                if manifest:
+                    manifest.set_stage(tile_name, 'process', FAILED, error=str(e))
+                else:
+                    # Nothing can resume this tile, so its downloads are of no further use
+                    shutil.rmtree(workspace, ignore_errors=True)
+
+    # Drop the run's directory once no tile workspace is left in it
+    if os.path.isdir(run_jobs_dir) and not os.listdir(run_jobs_dir):
+        os.rmdir(run_jobs_dir)
+    return results
+
+def create_large_output_map(bounding_box, temporal_range, sliding_window=False, run_name=None, select_scenes=True):
+    """Create maps for multiple tiles in a single operation.
+
+    Passing the run_name of an earlier run resumes it in place: tiles finished
+    with the same scenes and model are skipped and only the rest is redone.
+    With select_scenes, each tile's acquisitions are chosen from cloud cover
+    and Fmask; otherwise the hand-picked timestamps table below is used.
+    """
     # Define the tiles to process
     # tiles = ['42RWA', '42RWT', '42RWU', '42RWV', '42RXA', '42RXT', '42RXU', '42RXV', '42RYA', '42RYR', '42RYS', '42RYT', '42RYU', '42RYV', '42SWA', '42SWB', '42SWC', '42SXA', '42SXB', '42SXC', '42SYA', '42SYB', '42SYC', '43RBL', '43RBM', '43RBN', '43RBP', '43RBQ', '43RBR', '43RCL', '43RCM', '43RCN', '43RCP', '43RCQ', '43RCR', '43RDL', '43RDM', '43RDN', '43RDP', '43RDQ', '43RDR', '43REL', '43REM', '43REN', '43REP', '43REQ', '43RER', '43SBR', '43SBS', '43SBT', '43SCR', '43SCS', '43SCT', '43SDR', '43SDS', '43SDT', '43SER', '43SES', '43SET']
     #punjab cleaned tiles, less
@@ -248,16 +429,23 @@ def create_large_output_map(bounding_box, temporal_range):
     ('363', '268', '153'),
     (('353', '350'), ('268', '265'), ('155', '153'))]
 
-    results = search_hls_data(bounding_box, temporal_range)
+    # Search once and index the results by tile, date and band (cached on disk for repeated runs)
+    scene_index = search_scene_index(bounding_box, temporal_range)
     
-    if not results:
+    if not scene_index:
         print("No results found for the search criteria")
         return None
     
-    # Generate a single random name for the output directory
-    random_name = generate_random_name()
-    output_dir = os.path.join("/home/umer/projects/vector_studio/icons/cropmapping-server-two/mapdata", random_name)
+    if select_scenes:
+        # Three clearest acquisition windows per tile, from one Fmask pass over the province
+        timestamps = select_province_timestamps(scene_index, tiles)
+    
+    # Generate a single random name for the output directory, unless resuming a run
+    random_name = run_name or generate_random_name()
+    output_dir = os.path.join(MAPDATA_DIR, random_name)
     os.makedirs(output_dir, exist_ok=True)
+    manifest = RunManifest.open(output_dir, name=random_name, bounding_box=list(bounding_box),
+                                temporal_range=list(temporal_range), sliding_window=sliding_window)
     
     # Store information about all processed tiles
     all_tiles_info = {
@@ -266,20 +454,16 @@ def create_large_output_map(bounding_box, temporal_range):
         "tiles": []
     }
     
-    # Process each tile
-    for i, tile_name in enumerate(tiles):
-        print(f"Processing tile: {tile_name}", i + 1, "of", len(tiles))
+    # Process the tiles concurrently, then record them in their original order
+    results = process_tiles(scene_index, tiles, timestamps, output_dir, sliding_window=sliding_window,
+                            manifest=manifest, run_name=random_name)
+
+    for tile_name in tiles:
+        if tile_name not in results:
+            continue
         
         try:
-            # Filter results for this specific tile
-            filtered_results = filter_results_by_tile(results, tile_name)
-            
-            if not filtered_results:
-                print(f"No results found for tile {tile_name}")
-                continue
-            
-            # Create the map for this tile
-            png_path, tiff_path, json_path = create_single_map(filtered_results, tile_name, timestamps[i], output_dir)
+            png_path, tiff_path, json_path, source_files = results[tile_name]
             
             if png_path and json_path:
                 # Record the tile information
@@ -301,8 +485,7 @@ def create_large_output_map(bounding_box, temporal_range):
                     
                 # Store the source tiff files used for this tile
                 if os.path.exists(json_path):
-                    directory = '/home/umer/projects/vector_studio/icons/cropmapping-server-two/tempData/tiles'
-                    tiff_files = [os.path.basename(t) for t in os.listdir(directory) if t.endswith('.tif')]
+                    tiff_files = list(dict.fromkeys(os.path.basename(t) for t in source_files))
                     # Update the tile info with the source tiffs
                     tile_info["source_tiffs"] = tiff_files
         except Exception as e:
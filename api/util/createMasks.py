@@ -5,47 +5,27 @@ import numpy as np
 from PIL import Image
 import matplotlib.pyplot as plt
 from skimage import exposure
-from api.model.model import UNet  # Assuming your UNet model is imported from a file
+from api.model.registry import get_model, get_device
+from api.model.inference import predict_batches
+from api.util.palette import CLASS_COLORS, build_lut, colorize
 from api.model.dataloader import CropDataset  # If needed, otherwise you can customize loading here
 
-def createMasks(input_patches=None, profile=None, return_memory_masks=True):
-    # Define the color mapping for each class
-    CLASS_COLORS = {
-        0: (0, 0, 0),            # Black
-        1: (255, 192, 203),       # Pink - Natural
-        2: (144, 238, 144),       # Light Green - Forest
-        3: (255, 255, 0),         # Yellow - Corn
-        4: (0, 100, 0),           # Dark Green - Soybeans
-        5: (102, 205, 170),       # Medium Aquamarine - Wetlands
-        6: (128, 128, 128),       # Gray - Developed/Barren
-        7: (70, 130, 180),        # Steel Blue - Open Water
-        8: (139, 69, 19),         # Saddle Brown - Wheat
-        9: (255, 192, 203),       # Light Pink - Alfalfa
-        10: (189, 183, 107),      # Dark Khaki - Fallow/Idle
-        11: (255, 0, 0),          # Red - Cotton
-        12: (255, 165, 0),        # Orange - Sorghum
-        13: (0, 206, 209),        # Dark Turquoise - Other
-    }
+def createMasks(input_patches=None, profile=None, return_memory_masks=True, checkpoint_path=None,
+                batch_size=None, backend=None,
+                save_dir="/home/umer/projects/vector_studio/icons/cropmapping-server-two/tempData/patches_masks"):
+    # Lookup table mapping each class to its color
+    class_lut = build_lut(CLASS_COLORS)
 
     # Function to convert prediction mask to RGB image using class colors
     def convert_mask_to_rgb(pred_mask):
-        height, width = pred_mask.shape
-        rgb_mask = np.zeros((height, width, 3), dtype=np.uint8)
-        
-        for class_id, color in CLASS_COLORS.items():
-            rgb_mask[pred_mask == class_id] = color
+        return colorize(pred_mask, class_lut)
 
-        return rgb_mask
+    # Get the cached model (loaded once per process and kept in eval mode).
+    # backend is 'torch' (reference), 'onnx' (ONNX Runtime CPU) or 'int8' (quantized ONNX),
+    # defaulting to $INFERENCE_BACKEND
+    device = get_device(backend)
+    model = get_model(checkpoint_path, device=device, backend=backend)
 
-    # Load the model and checkpoint
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    model = UNet(in_channels=18, out_channels=14).to(device)
-    checkpoint_path = "/home/umer/projects/vector_studio/icons/cropmapping-server-two/api/model/unet_best.pth"
-    model.load_state_dict(torch.load(checkpoint_path))
-    model.to(device)
-    print(f"Model loaded from {checkpoint_path}")
-
-    save_dir = "/home/umer/projects/vector_studio/icons/cropmapping-server-two/tempData/patches_masks"
     os.makedirs(save_dir, exist_ok=True)  # Create the save directory if it doesn't exist
     
     # Arrays to store masks if we're returning them in memory
@@ -53,35 +33,25 @@ def createMasks(input_patches=None, profile=None, return_memory_masks=True):
     class_masks = []
     
     if input_patches is not None:
-        # Process patches directly from memory
-        # Iterate through each patch
-        for i in range(input_patches.shape[0]):
-            # Get the current patch
-            image = input_patches[i].astype(np.float32) / 255.0
-            
-            # Convert to PyTorch tensor and move to device
-            image_tensor = torch.tensor(image).unsqueeze(0).to(device)  # (1, C, H, W)
-            
-            # Pass the image through the model
-            model.eval()
-            with torch.no_grad():
-                prediction = model(image_tensor)
-                pred_mask = torch.argmax(prediction, dim=1).squeeze(0).cpu().numpy()  # (H, W)
-            
-            # Convert the predicted mask to RGB using the class colors
-            rgb_mask = convert_mask_to_rgb(pred_mask)
-            
-            if return_memory_masks:
-                # Store masks in memory
-                rgb_masks.append(rgb_mask)
-                class_masks.append(pred_mask)
-            
-            # Still save to disk for compatibility with existing code
-            save_path = os.path.join(save_dir, f"patch_{i}_mask.png")
-            Image.fromarray(rgb_mask).save(save_path)
-            
-            raw_tiff_save_path = os.path.join(save_dir, f"patch_{i}_class.tif")
-            tifffile.imwrite(raw_tiff_save_path, pred_mask.astype(np.uint8))
+        # Process patches directly from memory, a batch at a time
+        for start, pred_masks in predict_batches(model, input_patches, batch_size=batch_size, device=device):
+            for offset, pred_mask in enumerate(pred_masks):
+                i = start + offset
+
+                # Convert the predicted mask to RGB using the class colors
+                rgb_mask = convert_mask_to_rgb(pred_mask)
+
+                if return_memory_masks:
+                    # Store masks in memory
+                    rgb_masks.append(rgb_mask)
+                    class_masks.append(pred_mask)
+
+                # Still save to disk for compatibility with existing code
+                save_path = os.path.join(save_dir, f"patch_{i}_mask.png")
+                Image.fromarray(rgb_mask).save(save_path)
+
+                raw_tiff_save_path = os.path.join(save_dir, f"patch_{i}_class.tif")
+                tifffile.imwrite(raw_tiff_save_path, pred_mask)
     else:
         # Function to load image and make prediction
         def process_and_save(model, image_path, save_dir, device):
@@ -92,7 +62,6 @@ def createMasks(input_patches=None, profile=None, return_memory_masks=True):
             image_tensor = torch.tensor(image).unsqueeze(0).to(device)  # (1, C, H, W)
 
             # Pass the image through the model
-            model.eval()
             with torch.no_grad():
                 prediction = model(image_tensor)
                 pred_mask = torch.argmax(prediction, dim=1).squeeze(0).cpu().numpy()  # (H, W)
@@ -1,88 +1,181 @@
-# import os
-# import random
-# import string
-# import json
-# from shutil import move
-# from api.util.downloadTileEarthAccess import downloadTile, getTileBoundsInWGS84
-# from api.util.patchifyTileForPrithvi import patchifyTile
-# from api.util.createMasks import createMasks
-# from api.util.stitch256masks import stitch256masks
-
-# def generate_random_name(length=8):
-#     """Generate a random name of fixed length."""
-#     letters = string.ascii_lowercase
-#     return ''.join(random.choice(letters) for _ in range(length))
-
-# def get_tile_name(filename):
-#     # Split the filename by periods
-#     parts = filename.split('.')
-    
-#     # The tile name is the 3rd element in the list (index 2)
-#     tile_name = parts[2]
-    
-#     return tile_name
-
-# def create_map(bounding_box, temporal_range):
-#     # Step 1: Download the tiles
-#     tiles_dir, tiff_files = downloadTile(bounding_box, temporal_range)
-#     print("Tiles downloaded to: ", tiles_dir)
-#     directory = '/home/umer/projects/vector_studio/icons/cropmapping-server-two/tempData/tiles'
-#     # print("hi")
-#     # List all files and directories
-#     tiff_files = os.listdir(directory)
-#     tiff_files = [(directory + "/" + t) for t in tiff_files]
-#     # Extract the tile name from the first file (assuming it's in the filename)
-#     tile_name = get_tile_name(tiff_files[0]) #os.path.basename(tiff_files[0]).split('.')[0]
-#     print(f"Tile name: {tile_name}")
-
-#     # Step 2: Patchify the tiles
-#     patches_dir = patchifyTile(tiff_files)
-#     print("Patches made in: ", patches_dir)
-
-#     # Step 3: Generate masks
-#     masks_dir = createMasks()
-#     print("Masks saved in: ", masks_dir)
-
-#     # Step 4: Stitch the masks and generate the output PNG
-#     output_png = stitch256masks()
-#     print(f"Stitched mask output: {output_png}")
-
-#     # Step 5: Generate a random name
-#     random_name = generate_random_name()
-
-#     # Create a new directory to save the output PNG and JSON
-#     output_dir = os.path.join("mapdata", random_name)
-#     os.makedirs(output_dir, exist_ok=True)
-
-#     # Move the stitched PNG to the new folder
-#     new_png_path = os.path.join(output_dir, "stitched_tile.png")
-#     move(output_png, new_png_path)
-#     print(f"Moved stitched tile to: {new_png_path}")
-
-#     # Step 6: Get the bounds for the tile
-#     miny, maxy, maxx, minx = getTileBoundsInWGS84(tiff_files[0])
-
-#     # Step 7: Create JSON metadata
-#     json_data = {
-#         "name": random_name,
-#         "description": f"(Test only) UNet outputs for tile {tile_name}",
-#         "model": "UNet trained on Prithvi Crop Classification",
-#         "source": "NASA HLS Sentinel-2 30m",
-#         "tiles": [
-#             [
-#                 "stitched_tile.png",
-#                 maxy,
-#                 miny,
-#                 maxx,
-#                 minx
-#             ]
-#         ]
-#     }
-
-#     # Step 8: Save the JSON file in the same output directory
-#     json_path = os.path.join(output_dir, "data.json")
-#     with open(json_path, 'w') as json_file:
-#         json.dump(json_data, json_file, indent=4)
-#     print(f"Saved metadata to: {json_path}")
-
-#     return new_png_path, json_path
+import os
+import sys
+import math
+import random
+import string
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import rasterio
+from rasterio.transform import Affine, array_bounds
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window, from_bounds
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+from api.util.sceneIndex import search_scene_index
+from api.util.sceneSelection import select_timestamps
+from api.util.granuleCache import granule_cache, REMOTE_GDAL_OPTIONS, MAX_WORKERS
+from api.util.patchifyTileForPrithvi import unique_channels
+from api.util.tileInference import infer_tile, write_class_raster, OVERLAP, NODATA
+from api.util.palette import CLASS_COLORS, write_paletted_png
+from api.model.registry import get_model, get_device, IN_CHANNELS
+
+MAPDATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'mapdata')
+
+BANDS = ['B02', 'B03', 'B04', 'B05', 'B06', 'B07']
+
+# Pixels of context read around the bounding box, so its edge pixels are
+# classified with the same surroundings they would get in a full-tile run
+HALO = OVERLAP
+
+def generate_random_name(length=8):
+    """Generate a random name of fixed length."""
+    letters = string.ascii_lowercase
+    return ''.join(random.choice(letters) for _ in range(length))
+
+def channel_urls(tile_index, timestamps, bands=BANDS):
+    """Band URLs of a tile for a timestamps entry, one per model channel, time step by time step."""
+    if len(timestamps) == 1:
+        # A single scene stands in for all three time steps
+        timestamps = tuple(timestamps) * 3
+    urls = []
+    for timestamp in timestamps:
+        if isinstance(timestamp, tuple):
+            # Composite ranges: read the preferred scene of the range
+            timestamp = timestamp[0]
+        scene = tile_index.find(timestamp)
+        if scene:
+            urls.extend(tile_index.band_urls(scene, bands))
+    return urls
+
+def bbox_window(dataset, bounding_box, halo=HALO):
+    """Pixel window of dataset around a WGS84 bounding box, grown by halo pixels.
+
+    Returns (window, (row, col, height, width) of the box inside the window),
+    both clipped to the dataset, or (None, None) if they do not overlap.
+    """
+    left, bottom, right, top = transform_bounds('EPSG:4326', dataset.crs, *bounding_box)
+    box = from_bounds(left, bottom, right, top, transform=dataset.transform)
+    row_start = max(0, math.floor(box.row_off))
+    col_start = max(0, math.floor(box.col_off))
+    row_stop = min(dataset.height, math.ceil(box.row_off + box.height))
+    col_stop = min(dataset.width, math.ceil(box.col_off + box.width))
+    if row_stop <= row_start or col_stop <= col_start:
+        return None, None
+
+    halo_row = max(0, row_start - halo)
+    halo_col = max(0, col_start - halo)
+    window = Window(halo_col, halo_row,
+                    min(dataset.width, col_stop + halo) - halo_col,
+                    min(dataset.height, row_stop + halo) - halo_row)
+    return window, (row_start - halo_row, col_start - halo_col, row_stop - row_start, col_stop - col_start)
+
+def read_bbox_stack(urls, bounding_box, halo=HALO):
+    """Read only the window around bounding_box from each channel's COG.
+
+    Granules already in the granule cache are read locally, the rest with
+    HTTP range requests; repeated files are read once. Returns (stack,
+    window transform, crs, inner box) or Nones if the box misses the tile.
+    """
+    unique_urls, channels = unique_channels(urls)
+
+    with rasterio.Env(**REMOTE_GDAL_OPTIONS):
+        with rasterio.open(granule_cache.source(unique_urls[0])) as first:
+            window, inner = bbox_window(first, bounding_box, halo)
+            if window is None:
+                return None, None, None, None
+            transform = first.window_transform(window)
+            crs = first.crs
+
+    def read_window(url):
+        # rasterio.Env options are per thread
+        with rasterio.Env(**REMOTE_GDAL_OPTIONS):
+            with rasterio.open(granule_cache.source(url)) as src:
+                return src.read(1, window=window)
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        planes = list(pool.map(read_window, unique_urls))
+    return np.stack(planes)[channels], transform, crs, inner
+
+def create_map(bounding_box, temporal_range, halo=HALO, progress=None):
+    """Classify just the area of a WGS84 bounding box, reading only the pixels it needs.
+
+    Every HLS tile the box touches contributes the windows overlapping it
+    (plus a halo for context), which are classified with sliding-window
+    inference. Outputs go to a new mapdata/<name> directory with the same
+    data.json layout as the full-tile runs. progress(stage, detail) is
+    called as each stage starts, e.g. by the job queue.
+    """
+    progress = progress or (lambda stage, detail=None: None)
+
+    # Step 1: Find the scenes, picking the least cloudy acquisitions by metadata alone
+    progress('search')
+    scene_index = search_scene_index(bounding_box, temporal_range)
+    if not scene_index:
+        print("No results found for the search criteria")
+        return None, None
+
+    random_name = generate_random_name()
+    output_dir = os.path.join(MAPDATA_DIR, random_name)
+    os.makedirs(output_dir, exist_ok=True)
+
+    device = get_device()
+    model = get_model(device=device)
+    tiles = []
+
+    tile_names = scene_index.tiles()
+    for i, tile_name in enumerate(tile_names):
+        tile_index = scene_index.subset(tile_name)
+        timestamps = select_timestamps(tile_index, {}, tile_name)
+        urls = channel_urls(tile_index, timestamps) if timestamps else []
+        if len(urls) != IN_CHANNELS:
+            print(f"Skipping tile {tile_name}: found {len(urls)} of {IN_CHANNELS} band files")
+            continue
+
+        # Step 2: Read the bounding box window of every channel
+        progress('read', f"tile {tile_name} ({i + 1} of {len(tile_names)})")
+        stack, transform, crs, inner = read_bbox_stack(urls, bounding_box, halo)
+        if stack is None:
+            print(f"Bounding box does not overlap tile {tile_name}")
+            continue
+        print(f"Read {stack.shape} window from tile {tile_name}")
+
+        # Step 3: Classify the window and crop the halo off again
+        progress('inference', f"tile {tile_name} ({i + 1} of {len(tile_names)}), {stack.shape[1]}x{stack.shape[2]} px")
+        classes = infer_tile(lambda row, height: stack[:, row:row + height], stack.shape[1:], model, device=device)
+        row, col, height, width = inner
+        classes = classes[row:row + height, col:col + width]
+        transform = transform * Affine.translation(col, row)
+
+        # Step 4: Save the georeferenced class raster and its PNG
+        progress('write', f"tile {tile_name} ({i + 1} of {len(tile_names)})")
+        tiff_path = os.path.join(output_dir, f"stitched_tile_{tile_name}.tiff")
+        write_class_raster(tiff_path, classes, {'crs': crs, 'transform': transform})
+        png_name = f"stitched_tile_{tile_name}.png"
+        write_paletted_png(os.path.join(output_dir, png_name), classes, CLASS_COLORS, nodata=NODATA)
+
+        minx, miny, maxx, maxy = transform_bounds(crs, 'EPSG:4326', *array_bounds(height, width, transform))
+        tiles.append([png_name, maxy, miny, maxx, minx])
+
+    # Step 5: Create JSON metadata
+    json_data = {
+        "name": random_name,
+        "description": f"UNet outputs for bounding box {list(bounding_box)}",
+        "model": "UNet trained on Prithvi Crop Classification",
+        "source": "NASA HLS Sentinel-2 30m",
+        "tiles": tiles
+    }
+    json_path = os.path.join(output_dir, "data.json")
+    with open(json_path, 'w') as json_file:
+        json.dump(json_data, json_file, indent=4)
+    print(f"Saved metadata to: {json_path}")
+
+    return output_dir, json_path
+
+def run_map_job(progress, bounding_box, temporal_range):
+    """Job queue handler for bounding-box map generation."""
+    output_dir, json_path = create_map(bounding_box, temporal_range, progress=progress)
+    if not output_dir:
+        raise RuntimeError("No HLS scenes found for the bounding box")
+    return {"timestamp": os.path.basename(output_dir), "output_json": json_path}
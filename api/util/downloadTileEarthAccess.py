@@ -2,12 +2,16 @@ import earthaccess
 import rasterio
 import os
 from pathlib import Path
-import numpy as np
 import matplotlib.pyplot as plt
 from patchify import patchify
 import pyproj
 from rasterio.mask import mask
-import re
+
+from api.util.granuleCache import download_granules
+from api.util.sceneIndex import SceneIndex, search_scene_index
+from api.util.sceneSelection import FMASK_BAND, candidate_windows, scene_valid_masks, select_timestamps
+from api.util.composite import composite_scenes
+from api.util.patchifyTileForPrithvi import BAND_STACK_FILE, write_band_stack
 
 # 1. Authenticate with NASA Earthdata
 auth = earthaccess.login(strategy="netrc")
@@ -39,39 +43,6 @@ def search_hls_data(
     print(f"Found {len(results)} results")
     return results
 
-def extract_timestamp_from_filename(filename):
-    """Extract the 3-digit timestamp from an HLS S30 filename."""
-    match = re.search(r'\.(\d{4})(\d{3})T', os.path.basename(filename))
-    if match:
-        return match.group(2)  # Return the 3-digit timestamp
-    return None
-
-def extract_long_timestamp_from_filename(filename):
-    """Extract the 'DDDTHHMMSS' portion from an HLS S30 filename."""
-    match = re.search(r'\.(\d{3}T\d{6})', os.path.basename(filename))
-    if match:
-        return match.group(1)
-    return None
-
-def create_composite_image(img1_path, img2_path, output_path):
-    """Create a composite image by filling NoData from img1 with img2."""
-    with rasterio.open(img1_path) as src1:
-        img1 = src1.read(masked=True)
-        profile = src1.profile
-        
-    with rasterio.open(img2_path) as src2:
-        img2 = src2.read(masked=True)
-    
-    # Create composite: use img1 where it has data, otherwise use img2
-    composite = np.where(img1.mask, img2, img1)
-    
-    # Write the composite to file
-    with rasterio.open(output_path, 'w', **profile) as dst:
-        for i in range(composite.shape[0]):
-            dst.write(composite[i], i+1)
-    
-    return output_path
-
 def downloadTile(
     bounding_box=None,
     temporal_range=None,
@@ -82,23 +53,30 @@ def downloadTile(
     cloud_cover=(0, 20),
     bands_required=['B02', 'B03', 'B04', 'B05', 'B06', 'B07'],
     filtered_results=None,
-    valid_fraction_threshold=0.9,  # Keeping parameter for backwards compatibility
-    tile_name=None
+    valid_fraction_threshold=0.9,  # Minimum clear-pixel fraction when scenes are selected automatically
+    tile_name=None,
+    scene_index=None,
+    composite_method='best'  # 'best' clear observation or per-pixel 'median' for composite ranges
 ):
-    if filtered_results:
-        results = filtered_results
-    else:
-        if not bounding_box or not temporal_range:
-            raise ValueError("Need bounding_box and temporal_range")
-        results = search_hls_data(
-            bounding_box=bounding_box,
-            temporal_range=temporal_range,
-            short_name=short_name,
-            cloud_hosted=cloud_hosted,
-            cloud_cover=cloud_cover
-        )
+    # Scenes are looked up through a SceneIndex (tile/date/band dictionaries)
+    # instead of regex-scanning every URL of every result for each timestamp
+    if scene_index is None:
+        if filtered_results:
+            scene_index = SceneIndex.from_results(filtered_results)
+        else:
+            if not bounding_box or not temporal_range:
+                raise ValueError("Need bounding_box and temporal_range")
+            scene_index = search_scene_index(
+                bounding_box=bounding_box,
+                temporal_range=temporal_range,
+                short_name=short_name,
+                cloud_hosted=cloud_hosted,
+                cloud_cover=cloud_cover
+            )
+    if scene_index is not None and tile_name:
+        scene_index = scene_index.subset(tile_name)
 
-    if not results:
+    if not scene_index:
         print("No results found.")
         return None, []
         
@@ -107,69 +85,52 @@ def downloadTile(
     
     downloaded_files = []
     
+    if timestamps is None and len(scene_index.tiles()) == 1:
+        # Pick the clearest acquisition of each season window from the Fmask layers
+        candidates = [scene for window in candidate_windows(scene_index) for scene in window]
+        timestamps = select_timestamps(scene_index, scene_valid_masks(candidates),
+                                       valid_fraction_threshold=valid_fraction_threshold)
+    
     # Handle different timestamp formats
     if timestamps is None:
         # Original behavior - select first, middle, last scenes
-        if len(results) < 3:
+        scenes = scene_index.scenes
+        if len(scenes) < 3:
             print("Not enough results to choose 3 scenes.")
             return None, []
             
-        selected_scenes = [results[0], results[len(results)//2], results[-1]]
+        selected_scenes = [scenes[0], scenes[len(scenes)//2], scenes[-1]]
         
         # Download required bands
         urls_to_download = []
         for scene in selected_scenes:
-            for url in scene.data_links():
-                if any(band in url for band in bands_required):
-                    urls_to_download.append(url)
+            urls_to_download.extend(scene_index.band_urls(scene, bands_required))
                     
         if urls_to_download:
-            downloaded_files = earthaccess.download(urls_to_download, local_path=str(download_dir))
+            downloaded_files = download_granules(urls_to_download, str(download_dir))
             print(f"Downloaded {len(downloaded_files)} files")
     
     elif isinstance(timestamps, tuple):
         if all(isinstance(item, str) for item in timestamps):
             # Case: timestamps = ('007', '052', '098') - Specific timestamps
             if len(timestamps) == 1:
-                # Single timestamp - make three copies
+                # Single timestamp - reused for all three time steps
                 timestamp = timestamps[0]
                 print(f"Looking for single timestamp: {timestamp}")
                 
-                matching_scenes = []
-                for scene in results:
-                    for url in scene.data_links():
-                        if len(timestamp) == 10:
-                            if extract_long_timestamp_from_filename(url) == timestamp:
-                                matching_scenes.append(scene)
-                                break
-                        if extract_timestamp_from_filename(url) == timestamp:
-                            matching_scenes.append(scene)
-                            break
-                
-                if not matching_scenes:
+                scene = scene_index.find(timestamp)
+                if not scene:
                     print(f"No scenes found matching timestamp {timestamp}")
                     return None, []
                     
-                # Take the first matching scene
-                scene = matching_scenes[0]
-                urls_to_download = [url for url in scene.data_links() 
-                                   if any(band in url for band in bands_required)]
+                urls_to_download = scene_index.band_urls(scene, bands_required)
                 
                 if urls_to_download:
-                    downloaded_files = earthaccess.download(urls_to_download, local_path=str(download_dir))
+                    downloaded_files = download_granules(urls_to_download, str(download_dir))
                     print(f"Downloaded {len(downloaded_files)} files for timestamp {timestamp}")
                     
-                    # Make three copies of each file by renaming them
-                    new_files = []
-                    for file_path in downloaded_files:
-                        base_path = Path(file_path)
-                        for i in range(1, 3):  # Make 2 more copies (3 total)
-                            new_path = download_dir / f"{base_path.stem}_{i}{base_path.suffix}"
-                            # Copy the file
-                            with open(file_path, 'rb') as src_file, open(new_path, 'wb') as dst_file:
-                                dst_file.write(src_file.read())
-                            new_files.append(str(new_path))
-                    downloaded_files.extend(new_files)
+                    # The scene feeds all three time steps: list it three times, no file copies
+                    downloaded_files = downloaded_files * 3
             else:
                 # Multiple specific timestamps
                 print(f"Looking for specific timestamps: {timestamps}")
@@ -177,22 +138,9 @@ def downloadTile(
                 all_urls_to_download = []  # Collect all URLs first
                 
                 for timestamp in timestamps:
-                    matching_scenes = []
-                    for scene in results:
-                        for url in scene.data_links():
-                            if len(timestamp) == 10:
-                                if extract_long_timestamp_from_filename(url) == timestamp:
-                                    matching_scenes.append(scene)
-                                    break
-                            if extract_timestamp_from_filename(url) == timestamp:
-                                matching_scenes.append(scene)
-                                break
-                    
-                    if matching_scenes:
-                        # Take the first matching scene
-                        scene = matching_scenes[0]
-                        urls_for_timestamp = [url for url in scene.data_links() 
-                                          if any(band in url for band in bands_required)]
+                    scene = scene_index.find(timestamp)
+                    if scene:
+                        urls_for_timestamp = scene_index.band_urls(scene, bands_required)
                         
                         if urls_for_timestamp:
                             all_urls_to_download.extend(urls_for_timestamp)
@@ -202,7 +150,7 @@ def downloadTile(
                 
                 # Download all files at once
                 if all_urls_to_download:
-                    downloaded_files = earthaccess.download(all_urls_to_download, local_path=str(download_dir))
+                    downloaded_files = download_granules(all_urls_to_download, str(download_dir))
                     print(f"Downloaded {len(downloaded_files)} files for all timestamps")
         
         elif all(isinstance(item, tuple) for item in timestamps):
@@ -211,96 +159,67 @@ def downloadTile(
             
             composite_dir = download_dir / "composites"
             composite_dir.mkdir(parents=True, exist_ok=True)
+            channel_files = []
             
             for i, timestamp_range in enumerate(timestamps):
-                composite_files = []
-                
-                # Get all files for this timestamp range
-                range_files = {}
-                for band in bands_required:
-                    range_files[band] = []
-                
+                # Every distinct scene of the range, in the order given (the preferred scene first)
+                scenes = []
                 for timestamp in timestamp_range:
-                    matching_scenes = []
-                    for scene in results:
-                        for url in scene.data_links():
-                            if len(timestamp) == 10:
-                                if extract_long_timestamp_from_filename(url) == timestamp:
-                                    matching_scenes.append(scene)
-                                    break
-                            if extract_timestamp_from_filename(url) == timestamp:
-                                matching_scenes.append(scene)
-                                break
-                    
-                    if matching_scenes:
-                        # Take the first matching scene
-                        scene = matching_scenes[0]
-                        for url in scene.data_links():
-                            for band in bands_required:
-                                if band in url:
-                                    range_files[band].append(url)
+                    scene = scene_index.find(timestamp)
+                    if scene and scene not in scenes and all(band in scene["bands"] for band in bands_required):
+                        scenes.append(scene)
+                if not scenes:
+                    # A missing window would shift every later time step onto the wrong model channels
+                    raise RuntimeError(f"No scenes with bands {bands_required} found for timestamp range "
+                                       f"{timestamp_range} of tile {tile_name}")
                 
-                # Download all files for the timestamp range
-                all_urls = [url for band_urls in range_files.values() for url in band_urls]
-                if all_urls:
-                    range_downloaded_files = earthaccess.download(all_urls, local_path=str(download_dir))
-                    downloaded_files.extend(range_downloaded_files)
-                    
-                    # Create composites for each band
-                    for band in bands_required:
-                        band_files = [f for f in range_downloaded_files if band in f]
-                        if len(band_files) >= 2:
-                            composite_path = str(composite_dir / f"HLS.S30.{tile_name}.composite_{i}_{band}.tif")
-                            try:
-                                create_composite_image(band_files[0], band_files[1], composite_path)
-                                composite_files.append(composite_path)
-                            except Exception as e:
-                                print(f"Error creating composite for {band}: {e}")
+                # Download all bands of every scene, with their Fmask to guide the composite
+                with_fmask = all(FMASK_BAND in scene["bands"] for scene in scenes)
+                scene_bands = list(bands_required) + ([FMASK_BAND] if with_fmask else [])
+                all_urls = [url for scene in scenes for url in scene_index.band_urls(scene, scene_bands)]
+                range_downloaded_files = download_granules(all_urls, str(download_dir))
+                scene_files = [range_downloaded_files[k:k + len(scene_bands)]
+                               for k in range(0, len(range_downloaded_files), len(scene_bands))]
+                
+                # Composite all bands of all scenes in one blockwise pass
+                composite_files = [str(composite_dir / f"HLS.S30.{tile_name}.composite_{i}_{band}.tif")
+                                   for band in bands_required]
+                try:
+                    composite_scenes([files[:len(bands_required)] for files in scene_files], composite_files,
+                                     fmask_files=[files[-1] for files in scene_files] if with_fmask else None,
+                                     method=composite_method)
+                except Exception as e:
+                    raise RuntimeError(f"Error creating composite for range {timestamp_range} of tile {tile_name}: {e}") from e
+                channel_files.extend(composite_files)
                 
                 output_dir = str(composite_dir)
-                downloaded_files.extend(composite_files)
+            
+            # The composites, not the raw scenes, are the model channels: every window adds all its bands or fails the tile
+            downloaded_files = channel_files
     
     elif isinstance(timestamps, str):
-        # Single timestamp as a string - make three copies
+        # Single timestamp as a string - reused for all three time steps
         timestamp = timestamps
         print(f"Looking for single timestamp: {timestamp}")
         
-        matching_scenes = []
-        for scene in results:
-            for url in scene.data_links():
-                if len(timestamp) == 10:
-                    if extract_long_timestamp_from_filename(url) == timestamp:
-                        matching_scenes.append(scene)
-                        break
-                if extract_timestamp_from_filename(url) == timestamp:
-                    matching_scenes.append(scene)
-                    break
-        
-        if not matching_scenes:
+        scene = scene_index.find(timestamp)
+        if not scene:
             print(f"No scenes found matching timestamp {timestamp}")
             return None, []
             
-        # Take the first matching scene
-        scene = matching_scenes[0]
-        urls_to_download = [url for url in scene.data_links() 
-                           if any(band in url for band in bands_required)]
+        urls_to_download = scene_index.band_urls(scene, bands_required)
         
         if urls_to_download:
-            downloaded_files = earthaccess.download(urls_to_download, local_path=str(download_dir))
+            downloaded_files = download_granules(urls_to_download, str(download_dir))
             print(f"Downloaded {len(downloaded_files)} files for timestamp {timestamp}")
             
-            # Make three copies of each file by renaming them
-            new_files = []
-            for file_path in downloaded_files:
-                base_path = Path(file_path)
-                for i in range(1, 3):  # Make 2 more copies (3 total)
-                    new_path = download_dir / f"{base_path.stem}_{i}{base_path.suffix}"
-                    # Copy the file
-                    with open(file_path, 'rb') as src_file, open(new_path, 'wb') as dst_file:
-                        dst_file.write(src_file.read())
-                    new_files.append(str(new_path))
-            downloaded_files.extend(new_files)
+            # The scene feeds all three time steps: list it three times, no file copies
+            downloaded_files = downloaded_files * 3
+    
+    if downloaded_files:
+        write_band_stack(downloaded_files, os.path.join(output_dir, BAND_STACK_FILE))
     
+    # downloaded_files is the band stack: one path per model channel, time step by time step
     return output_dir, downloaded_files
 
 def getTileBoundsInWGS84(tile):
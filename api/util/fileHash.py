@@ -0,0 +1,17 @@
+import os
+import hashlib
+
+_checksums = {}
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """sha256 of a file, cached per (path, size, mtime) so large files are hashed once."""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if key not in _checksums:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        _checksums[key] = digest.hexdigest()
+    return _checksums[key]
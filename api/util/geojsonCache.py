@@ -0,0 +1,172 @@
+import os
+import gzip
+import json
+import hashlib
+import threading
+
+from api.util.fileHash import file_sha256
+
+try:
+    import brotli
+except ImportError:
+    # Optional: without it responses are offered gzip-compressed only
+    brotli = None
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+
+# level -> (GeoJSON file, name property, id property)
+GEOJSON_LEVELS = {
+    'provinces': ('provinces.json', 'NAME_1', 'GID_1'),
+    'all': ('all.json', 'NAME_3', 'GID_3'),
+    'districts': ('districts.json', 'NAME_3', 'GID_3'),
+}
+DEFAULT_LEVEL = 'districts'
+
+# Simplified copies of every level, built offline by api/util/boundaryTiers.py.
+# Each tier records the SHA-256 of the file it was built from under this key;
+# a tier whose source has changed since is not served.
+TIERS_DIR = os.path.join(ROOT_DIR, 'boundary_tiers')
+SOURCE_HASH_KEY = 'source_sha256'
+
+# (max zoom, simplification tolerance in degrees, coordinate decimals), coarsest first.
+# Tolerances stay under a screen pixel at the tier's max zoom (0.044 deg at z5,
+# 0.011 at z7, 0.0027 at z9); above the last tier the full-resolution file is served.
+SIMPLIFY_TIERS = (
+    (5, 0.02, 2),
+    (7, 0.005, 3),
+    (9, 0.001, 4),
+)
+
+
+def tier_path(level, max_zoom, tiers_dir=TIERS_DIR):
+    return os.path.join(tiers_dir, f"{level}_z{max_zoom}.json")
+
+
+def select_tier(zoom=None, tolerance=None, tiers=SIMPLIFY_TIERS):
+    """Max zoom of the tier for a map zoom, or the coarsest tier within a tolerance; None for full resolution."""
+    for max_zoom, tier_tolerance, _ in tiers:
+        if zoom is not None and zoom <= max_zoom:
+            return max_zoom
+        if zoom is None and tolerance is not None and tier_tolerance <= tolerance:
+            return max_zoom
+    return None
+
+
+class CachedBody:
+    """A serialized response body with its precompressed encodings and ETag."""
+
+    def __init__(self, body, version):
+        self.version = version
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.encodings = {
+            'identity': body,
+            # mtime=0 keeps the gzip bytes identical across rebuilds of an unchanged file
+            'gzip': gzip.compress(body, compresslevel=9, mtime=0),
+        }
+        if brotli is not None:
+            self.encodings['br'] = brotli.compress(body, quality=11)
+
+    def encode(self, accept_encodings):
+        """(encoding, body, ETag) for the smallest encoding the client accepts."""
+        accepted = [name for name in self.encodings if name == 'identity' or accept_encodings[name] > 0]
+        encoding = min(accepted, key=lambda name: len(self.encodings[name]))
+        # Every encoding is its own representation, with its own ETag
+        etag = self.etag if encoding == 'identity' else f"{self.etag}-{encoding}"
+        return encoding, self.encodings[encoding], etag
+
+
+def file_version(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def serialize_level(path, name_key, id_key):
+    """The /api/geojson response body of one level: its polygon names and IDs plus the GeoJSON itself."""
+    with open(path, 'r') as f:
+        geojson_data = json.load(f)
+    return serialize_geojson(geojson_data, name_key, id_key)
+
+
+def serialize_geojson(geojson_data, name_key, id_key):
+    # Extract the names of the polygons (district or province names in "NAME_3" or "NAME_1" depending on the level)
+    polygons = [
+        {"name": feature["properties"].get(name_key), "id": feature["properties"].get(id_key)}
+        for feature in geojson_data["features"]
+    ]
+    # Sorted, compact keys: the same body jsonify produced
+    return json.dumps({"polygons": polygons, "geojson": geojson_data}, separators=(',', ':'), sort_keys=True).encode('utf-8')
+
+
+class GeojsonCache:
+    """Serialized and compressed /api/geojson bodies, built once per level, tier and file version.
+
+    Each level (and simplification tier) is parsed and encoded on first use
+    (or by preload()); later requests only stat the file, and a changed
+    mtime or size rebuilds it. Tiers that have not been built fall back to
+    the full-resolution file.
+    """
+
+    def __init__(self, root_dir=ROOT_DIR, levels=GEOJSON_LEVELS, tiers_dir=TIERS_DIR, tiers=SIMPLIFY_TIERS):
+        self.root_dir = root_dir
+        self.levels = levels
+        self.tiers_dir = tiers_dir
+        self.tiers = tiers
+        self._bodies = {}
+        self._lock = threading.Lock()
+
+    def source_path(self, level):
+        return os.path.join(self.root_dir, self.levels[level][0])
+
+    def path(self, level, tier=None):
+        if tier is not None:
+            path = tier_path(level, tier, self.tiers_dir)
+            if os.path.exists(path):
+                return path
+        return self.source_path(level)
+
+    def get(self, level, tier=None):
+        """Cached body of a level at a tier (a max zoom of SIMPLIFY_TIERS, None for full resolution).
+
+        A tier built from an older version of the level's file is skipped in
+        favour of the full-resolution file. Raises FileNotFoundError if the
+        level's file is missing.
+        """
+        source = self.source_path(level)
+        source_version = file_version(source)
+        path = self.path(level, tier)
+        # Keyed by the source too, so editing it rechecks every tier built from it
+        version = (path,) + file_version(path) + source_version
+        cached = self._bodies.get((level, tier))
+        if cached is not None and cached.version == version:
+            return cached
+
+        with self._lock:
+            cached = self._bodies.get((level, tier))
+            if cached is None or cached.version != version:
+                with open(path, 'r') as f:
+                    geojson_data = json.load(f)
+                if path != source:
+                    built_from = geojson_data.pop(SOURCE_HASH_KEY, None)
+                    if built_from != file_sha256(source):
+                        print(f"Warning: {os.path.basename(path)} was not built from the current "
+                              f"{os.path.basename(source)}, serving the full file; rebuild with api/util/boundaryTiers.py")
+                        path = source
+                        with open(path, 'r') as f:
+                            geojson_data = json.load(f)
+                _, name_key, id_key = self.levels[level]
+                cached = CachedBody(serialize_geojson(geojson_data, name_key, id_key), version)
+                self._bodies[(level, tier)] = cached
+                print(f"Cached {os.path.basename(path)} GeoJSON: {len(cached.encodings['identity'])} bytes, "
+                      + ", ".join(f"{name} {len(body)}" for name, body in cached.encodings.items() if name != 'identity'))
+        return cached
+
+    def preload(self):
+        for level in self.levels:
+            for tier in [max_zoom for max_zoom, _, _ in self.tiers] + [None]:
+                try:
+                    self.get(level, tier)
+                except FileNotFoundError:
+                    print(f"Skipping {level} GeoJSON: {self.source_path(level)} not found")
+
+
+geojson_cache = GeojsonCache()
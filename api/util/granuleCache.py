@@ -0,0 +1,161 @@
+import os
+import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import earthaccess
+
+# Persistent granule cache shared by every run, outside the per-run tempData/tiles directory
+CACHE_DIR = os.environ.get(
+    'GRANULE_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'tempData', 'granules')
+)
+CACHE_SIZE_GB = float(os.environ.get('GRANULE_CACHE_SIZE_GB', 50))
+MAX_WORKERS = int(os.environ.get('GRANULE_DOWNLOAD_WORKERS', 8))
+
+CHUNK_SIZE = 1024 * 1024
+
+# GDAL settings for windowed reads of remote HLS COGs: Earthdata credentials
+# come from ~/.netrc and the session cookies are kept across requests
+REMOTE_GDAL_OPTIONS = {
+    'GDAL_HTTP_COOKIEFILE': os.path.expanduser('~/cookies.txt'),
+    'GDAL_HTTP_COOKIEJAR': os.path.expanduser('~/cookies.txt'),
+    'GDAL_HTTP_NETRC': 'YES',
+    'GDAL_DISABLE_READDIR_ON_OPEN': 'EMPTY_DIR',
+    'CPL_VSIL_CURL_ALLOWED_EXTENSIONS': 'TIF',
+    'GDAL_HTTP_MAX_RETRY': '5',
+    'GDAL_HTTP_RETRY_DELAY': '1',
+}
+
+
+class GranuleCache:
+    """On-disk cache of downloaded HLS files keyed by their URL, with LRU eviction past a size cap.
+
+    Files are stored as <cache_dir>/<sha256(url)[:16]>/<original file name>
+    and linked into the caller's download directory, so reruns, retries and
+    other seasons over the same tile skip the network. Recency is tracked
+    through the file mtime, which is bumped on every hit.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_SIZE_GB * 1024 ** 3, max_workers=MAX_WORKERS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_workers = max_workers
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes_downloaded': 0}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path_for(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.cache_dir, key, os.path.basename(url))
+
+    def _session(self):
+        # One authenticated session per worker thread, so connections are kept alive and reused
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = earthaccess.get_requests_https_session()
+            self._local.session = session
+        return session
+
+    def _count(self, stat, amount=1):
+        with self._lock:
+            self.stats[stat] += amount
+
+    def _download(self, url):
+        path = self.path_for(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f"{path}.part"
+        with self._session().get(url, stream=True, timeout=300) as response:
+            response.raise_for_status()
+            with open(partial, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
+        # Only complete files ever appear under the final name
+        os.replace(partial, path)
+        self._count('bytes_downloaded', os.path.getsize(path))
+        return path
+
+    def get(self, url):
+        """Return the cached path for url, downloading it on a miss."""
+        path = self.path_for(url)
+        if os.path.exists(path):
+            self._count('hits')
+            os.utime(path)
+            return path
+        self._count('misses')
+        return self._download(url)
+
+    def source(self, url):
+        """Path to read url from: the cached file if there is one, otherwise the URL itself for GDAL to read remotely."""
+        path = self.path_for(url)
+        if os.path.exists(path):
+            self._count('hits')
+            os.utime(path)
+            return path
+        return url
+
+    def fetch(self, urls, local_path):
+        """Make every URL available in local_path, downloading misses in parallel.
+
+        Returns the local file paths in the order of urls, like earthaccess.download.
+        """
+        os.makedirs(local_path, exist_ok=True)
+        unique_urls = list(dict.fromkeys(urls))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            cached = dict(zip(unique_urls, pool.map(self.get, unique_urls)))
+        cached_paths = [cached[url] for url in urls]
+
+        local_files = []
+        for cached_path in cached_paths:
+            local_file = os.path.join(local_path, os.path.basename(cached_path))
+            if not os.path.exists(local_file):
+                try:
+                    os.link(cached_path, local_file)
+                except OSError:
+                    # Different filesystem, fall back to a real copy
+                    shutil.copy2(cached_path, local_file)
+            local_files.append(local_file)
+
+        self.evict(keep=set(cached_paths))
+        print(f"Granule cache: {self.stats['hits']} hits, {self.stats['misses']} misses")
+        return local_files
+
+    def evict(self, keep=()):
+        """Delete least recently used files until the cache fits in max_bytes."""
+        entries = []
+        total = 0
+        for key in os.listdir(self.cache_dir):
+            key_dir = os.path.join(self.cache_dir, key)
+            if not os.path.isdir(key_dir):
+                continue
+            for name in os.listdir(key_dir):
+                path = os.path.join(key_dir, name)
+                if name.endswith('.part'):
+                    continue
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path in keep:
+                continue
+            os.remove(path)
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+            total -= size
+            self._count('evictions')
+
+
+granule_cache = GranuleCache()
+
+
+def download_granules(urls, local_path):
+    """Cached, parallel drop-in for earthaccess.download(urls, local_path=...)."""
+    return granule_cache.fetch(urls, local_path)
@@ -0,0 +1,266 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import hashlib
+import threading
+import traceback
+from contextlib import contextmanager
+
+# Jobs survive restarts: the queue lives in a small SQLite database
+JOBS_DB = os.environ.get(
+    'JOBS_DB',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'tempData', 'jobs.sqlite3')
+)
+MAX_WORKERS = int(os.environ.get('MAP_JOB_WORKERS', 1))
+
+# Running jobs are stamped by their process this often; a job whose stamp is
+# older than STALE_AFTER belongs to a process that is gone, and is queued again
+HEARTBEAT_INTERVAL = float(os.environ.get('MAP_JOB_HEARTBEAT', 30))
+STALE_AFTER = 4 * HEARTBEAT_INTERVAL
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    stages TEXT NOT NULL DEFAULT '{}',
+    result TEXT,
+    error TEXT,
+    owner TEXT,
+    heartbeat REAL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, status);
+"""
+
+
+def job_key(kind, params):
+    """Identical requests share a key, so in-flight duplicates can be merged."""
+    payload = json.dumps([kind, params], sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class JobQueue:
+    """Persistent job queue run by a bounded pool of local worker threads.
+
+    submit() returns a job ID straight away; a worker later claims the job
+    and calls the handler registered for its kind as handler(progress,
+    **params), where progress(stage, detail=None) records the stage the job
+    has reached. Every process running jobs stamps them with a heartbeat;
+    jobs whose process stopped (crashed, restarted) are queued again, while
+    jobs another live process (e.g. another gunicorn worker) is running are
+    left alone.
+    """
+
+    def __init__(self, db_path=JOBS_DB, max_workers=MAX_WORKERS):
+        self.db_path = db_path
+        self.max_workers = max_workers
+        self.handlers = {}
+        self._wakeup = threading.Condition()
+        self._workers = []
+        self._heartbeat = None
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self._transaction() as conn:
+            conn.executescript(SCHEMA)
+            # Databases created before jobs had owners
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in (("owner", "TEXT"), ("heartbeat", "REAL")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+        self.requeue_stale()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextmanager
+    def _transaction(self, immediate=False):
+        """A connection committed on success and always closed; immediate takes the write lock up front."""
+        conn = self._connect()
+        try:
+            with conn:
+                if immediate:
+                    conn.execute("BEGIN IMMEDIATE")
+                yield conn
+        finally:
+            conn.close()
+
+    def requeue_stale(self, stale_after=STALE_AFTER):
+        """Queue again the running jobs whose process has stopped sending heartbeats."""
+        now = time.time()
+        with self._transaction() as conn:
+            requeued = conn.execute(
+                "UPDATE jobs SET status = ?, owner = NULL, updated = ? "
+                "WHERE status = ? AND (heartbeat IS NULL OR heartbeat < ?)",
+                (QUEUED, now, RUNNING, now - stale_after)
+            ).rowcount
+        if requeued:
+            print(f"Requeued {requeued} map job(s) left running by a stopped process")
+        return requeued
+
+    def register(self, kind, handler):
+        self.handlers[kind] = handler
+
+    def start(self):
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(target=self._work, name=f"map-job-worker-{len(self._workers)}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        if self._workers and self._heartbeat is None:
+            self._heartbeat = threading.Thread(target=self._beat, name="map-job-heartbeat", daemon=True)
+            self._heartbeat.start()
+        return self
+
+    def _beat(self):
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            try:
+                with self._transaction() as conn:
+                    conn.execute("UPDATE jobs SET heartbeat = ? WHERE owner = ? AND status = ?",
+                                 (time.time(), self.owner, RUNNING))
+            except sqlite3.Error as e:
+                # A missed beat is retried on the next one, well before the job looks stale
+                print(f"Map job heartbeat failed: {e}")
+
+    def submit(self, kind, params):
+        """Queue a job, or return the ID of an identical job that is still queued or running."""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind {kind!r}")
+        key = job_key(kind, params)
+        now = time.time()
+        # The write lock is taken before the lookup, so two identical requests cannot both insert
+        with self._transaction(immediate=True) as conn:
+            existing = conn.execute(
+                "SELECT id FROM jobs WHERE key = ? AND status IN (?, ?) ORDER BY created LIMIT 1",
+                (key, QUEUED, RUNNING)
+            ).fetchone()
+            if existing:
+                return existing["id"], False
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO jobs (id, key, kind, params, status, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, key, kind, json.dumps(params), QUEUED, now, now)
+            )
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id, True
+
+    def get(self, job_id):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        for field in ("key", "owner", "heartbeat"):
+            job.pop(field)
+        for field in ("params", "stages", "result"):
+            job[field] = json.loads(job[field]) if job[field] else None
+        if job["status"] == QUEUED:
+            with self._transaction() as conn:
+                job["queue_position"] = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = ? AND created < ?", (QUEUED, job["created"])
+                ).fetchone()[0]
+        return job
+
+    def _claim(self):
+        """Atomically move the oldest queued job to running; None if the queue is empty."""
+        with self._transaction() as conn:
+            while True:
+                row = conn.execute(
+                    "SELECT id, kind, params FROM jobs WHERE status = ? ORDER BY created LIMIT 1", (QUEUED,)
+                ).fetchone()
+                if row is None:
+                    return None
+                now = time.time()
+                claimed = conn.execute(
+                    "UPDATE jobs SET status = ?, owner = ?, heartbeat = ?, updated = ? WHERE id = ? AND status = ?",
+                    (RUNNING, self.owner, now, now, row["id"], QUEUED)
+                ).rowcount
+                conn.commit()
+                if claimed:
+                    return row["id"], row["kind"], json.loads(row["params"])
+
+    def _update(self, job_id, **fields):
+        fields["updated"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._transaction() as conn:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def _run(self, job_id, kind, params):
+        stages = {}
+
+        def progress(stage, detail=None):
+            # Entering a stage completes the one before it
+            for name, info in stages.items():
+                if info["status"] == RUNNING and name != stage:
+                    info["status"] = DONE
+            stages[stage] = {"status": RUNNING, "detail": detail, "time": time.time()}
+            self._update(job_id, stage=stage, stages=json.dumps(stages))
+
+        print(f"Starting {kind} job {job_id}")
+        try:
+            result = self.handlers[kind](progress, **params)
+        except Exception as e:
+            print(traceback.format_exc())
+            for info in stages.values():
+                if info["status"] == RUNNING:
+                    info["status"] = FAILED
+            self._update(job_id, status=FAILED, error=str(e), stages=json.dumps(stages))
+            return
+        for info in stages.values():
+            info["status"] = DONE
+        self._update(job_id, status=DONE, stage=None, stages=json.dumps(stages), result=json.dumps(result))
+        print(f"Finished {kind} job {job_id}")
+
+    def _work(self):
+        while True:
+            job = self._claim()
+            if job is None:
+                # Pick up jobs orphaned by a process that stopped while this one was running
+                self.requeue_stale()
+                with self._wakeup:
+                    # Also poll, so jobs queued by another process are picked up
+                    self._wakeup.wait(timeout=5)
+                continue
+            self._run(*job)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """The process-wide map job queue, with its handlers registered and workers started.
+
+    Called when the app starts, so queued and orphaned jobs resume without
+    waiting for a request.
+    """
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+            _queue.register('bbox_map', run_map_job)
+            _queue.start()
+    return _queue
+
+
+def run_map_job(progress, **params):
+    # Imported on the first job, so starting the queue does not load the model stack
+    from api.util.createOutputMap import run_map_job
+    return run_map_job(progress, **params)
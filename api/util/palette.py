@@ -0,0 +1,127 @@
+import warnings
+
+import numpy as np
+import rasterio
+from rasterio.io import MemoryFile
+from rasterio.errors import NotGeoreferencedWarning
+
+# Colors of the 14 UNet classes, as rendered in the stitched tile PNGs
+CLASS_COLORS = {
+    0: (0, 0, 0),            # Black
+    1: (255, 192, 203),       # Pink - Natural
+    2: (144, 238, 144),       # Light Green - Forest
+    3: (255, 255, 0),         # Yellow - Corn
+    4: (0, 100, 0),           # Dark Green - Soybeans
+    5: (102, 205, 170),       # Medium Aquamarine - Wetlands
+    6: (128, 128, 128),       # Gray - Developed/Barren
+    7: (70, 130, 180),        # Steel Blue - Open Water
+    8: (139, 69, 19),         # Saddle Brown - Wheat
+    9: (255, 192, 203),       # Light Pink - Alfalfa
+    10: (189, 183, 107),      # Dark Khaki - Fallow/Idle
+    11: (255, 0, 0),          # Red - Cotton
+    12: (255, 165, 0),        # Orange - Sorghum
+    13: (0, 206, 209),        # Dark Turquoise - Other
+}
+
+# Grouped colors for the province/district maps: urban/barren, natural, the
+# season's main crop and other crops. Rabi (Jan-Apr) maps show the crop
+# classes as wheat in orange, kharif (Jun-Dec) maps as cotton in light blue.
+WHEAT_COLORS = {
+    0: (194, 81, 0),
+    13: (194, 81, 0),
+    6: (194, 81, 0),
+    7: (0, 100, 0),
+    1: (0, 100, 0),
+    2: (0, 100, 0),
+
+    3: (255, 166, 0),
+    4: (255, 166, 0),
+    8: (255, 166, 0),
+    9: (255, 166, 0),
+    12: (255, 166, 0),
+
+    10: (212, 255, 71),
+    5: (212, 255, 71),
+    11: (212, 255, 71)
+}
+COTTON_COLORS = dict(WHEAT_COLORS)
+COTTON_COLORS.update({cls: (161, 238, 255) for cls in (3, 4, 8, 9, 12)})
+
+LUT_SIZE = 256
+
+
+def build_lut(color_map, alpha=False, nodata=None):
+    """Build a (256, 3) RGB or (256, 4) RGBA lookup table indexed by class value.
+
+    Classes missing from color_map are black (opaque when alpha is set). The
+    nodata value is transparent; negative nodata values such as -1 index the
+    table from the end, so lut[arr] works directly on signed rasters.
+    """
+    lut = np.zeros((LUT_SIZE, 4 if alpha else 3), dtype=np.uint8)
+    if alpha:
+        lut[:, 3] = 255
+    for cls, color in color_map.items():
+        lut[cls, :3] = color
+    if nodata is not None:
+        lut[nodata] = 0
+    return lut
+
+
+def colorize(arr, lut):
+    """Colorize a class raster in a single lookup-table pass, returning (H, W, 3|4) uint8."""
+    return lut[arr]
+
+
+def build_palette(color_map, nodata=None):
+    """Build a compact palette for a class color map.
+
+    Returns a (256,) uint8 lookup table from class value to palette index and
+    the matching GDAL color table ({index: (r, g, b, a)}). Classes sharing a
+    color share a palette entry, and nodata gets its own transparent entry.
+    """
+    colors, index_lut = np.unique(build_lut(color_map, alpha=True, nodata=nodata), axis=0, return_inverse=True)
+    colormap = {i: tuple(int(v) for v in color) for i, color in enumerate(colors)}
+    return index_lut.reshape(-1).astype(np.uint8), colormap
+
+
+def write_paletted_png(path, arr, color_map, transform=None, crs=None, nodata=None):
+    """Write a class raster as a single-band paletted (mode "P") PNG.
+
+    Pixels are written as indices into the distinct colors of color_map, and
+    nodata keeps its own palette slot with zero alpha (stored by the PNG driver
+    as a tRNS chunk), so the output stays transparent outside the clip while
+    storing one byte per pixel instead of four.
+    """
+    index_lut, colormap = build_palette(color_map, nodata)
+    indices = colorize(arr, index_lut)
+    profile = {
+        "driver": "PNG",
+        "height": indices.shape[0],
+        "width": indices.shape[1],
+        "count": 1,
+        "dtype": "uint8",
+    }
+    if transform is not None:
+        profile["transform"] = transform
+    if crs is not None:
+        profile["crs"] = crs
+
+    with rasterio.open(path, 'w', **profile) as dst:
+        dst.write(indices, 1)
+        dst.write_colormap(1, colormap)
+    return path
+
+
+def encode_paletted_png(arr, color_map, nodata=None):
+    """Encode a class raster as paletted PNG bytes in memory, as write_paletted_png writes them to disk."""
+    index_lut, colormap = build_palette(color_map, nodata)
+    indices = colorize(arr, index_lut)
+    with MemoryFile() as memfile:
+        # Map tiles are placed by their z/x/y, not by georeferencing
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", NotGeoreferencedWarning)
+            with memfile.open(driver="PNG", height=indices.shape[0], width=indices.shape[1],
+                              count=1, dtype="uint8") as dst:
+                dst.write(indices, 1)
+                dst.write_colormap(1, colormap)
+        return memfile.read()
@@ -1,55 +1,150 @@
 import os
+import math
+import json
 import rasterio
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
-def patchifyTile(tiff_files, output_folder = "/home/umer/projects/vector_studio/icons/cropmapping-server-two/tempData/patches", save_to_disk=True):
-    patch_size = 224
+# Virtual band stack written by downloadTile next to the downloaded files
+BAND_STACK_FILE = 'band_stack.json'
+
+
+def write_band_stack(channel_files, path):
+    """Record which physical file feeds each model channel (files may repeat)."""
+    with open(path, 'w') as f:
+        json.dump({"channels": [str(file) for file in channel_files]}, f, indent=4)
+    return path
+
+
+def load_band_stack(directory):
+    """Channel file list written by downloadTile for directory."""
+    with open(os.path.join(directory, BAND_STACK_FILE)) as f:
+        return json.load(f)["channels"]
+
+
+def unique_channels(tiff_files):
+    """Split a channel file list into its distinct files and, per channel, the index of its file."""
+    unique_files = list(dict.fromkeys(tiff_files))
+    position = {file: i for i, file in enumerate(unique_files)}
+    return unique_files, np.array([position[file] for file in tiff_files])
+
+
+def patch_grid_size(length, patch_size, stride, pad_edges):
+    """Number of patch positions along one axis, and the (possibly padded) length they span."""
+    if pad_edges:
+        count = max(1, math.ceil(max(length - patch_size, 0) / stride) + 1)
+    else:
+        count = (length - patch_size) // stride + 1
+    return count, (count - 1) * stride + patch_size
+
+
+class PatchGrid:
+    """Zero-copy view of a (C, H, W) band stack as a grid of (C, patch_size, patch_size) patches.
+
+    Patches are strided views into the stack, ordered row by row. coords[i]
+    holds the (row, col) pixel offset of patch i in the tile, and tile_shape
+    the unpadded (height, width), so stitching can rebuild the full tile.
+    When channels is given, the stack holds each distinct file once and
+    channels maps model channels to stack planes; patches are then gathered
+    per patch instead of being views.
+    """
+
+    def __init__(self, stack, patch_size, stride, tile_shape, channels=None):
+        self.stack = stack
+        self.patch_size = patch_size
+        self.stride = stride
+        self.tile_shape = tile_shape
+        self.channels = channels
+
+        # (C, rows, cols, patch_size, patch_size) view, no data is copied
+        self.windows = sliding_window_view(stack, (patch_size, patch_size), axis=(1, 2))[:, ::stride, ::stride]
+        self.grid_shape = self.windows.shape[1:3]
+        self.coords = [
+            (row * stride, col * stride)
+            for row in range(self.grid_shape[0])
+            for col in range(self.grid_shape[1])
+        ]
+
+    @property
+    def shape(self):
+        num_channels = self.stack.shape[0] if self.channels is None else len(self.channels)
+        return (len(self), num_channels, self.patch_size, self.patch_size)
+
+    def __len__(self):
+        return self.grid_shape[0] * self.grid_shape[1]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return np.stack([self[i] for i in range(*index.indices(len(self)))])
+        if index < 0:
+            index += len(self)
+        row, col = divmod(index, self.grid_shape[1])
+        if self.channels is not None:
+            return self.windows[self.channels, row, col]
+        return self.windows[:, row, col]
+
+    def __array__(self, dtype=None, copy=None):
+        patches = self[:]
+        return patches if dtype is None else patches.astype(dtype)
+
+
+def read_band_stack(tiff_files, padded_shape=None):
+    """Read the first band of each file into one preallocated (C, H, W) array.
+
+    When padded_shape is larger than the tiles, the extra bottom rows and right
+    columns are zero-filled so edge patches can cover the whole tile.
+    """
+    with rasterio.open(tiff_files[0]) as src:
+        profile = src.profile
+        height, width = src.height, src.width
+        dtype = src.dtypes[0]
+
+    padded_height, padded_width = padded_shape or (height, width)
+    stack = np.empty((len(tiff_files), padded_height, padded_width), dtype=dtype)
+    stack[:, height:, :] = 0
+    stack[:, :, width:] = 0
+
+    for i, file in enumerate(tiff_files):
+        with rasterio.open(file) as src:
+            # Read straight into the stack, no intermediate per-band array
+            src.read(1, out=stack[i, :height, :width])
+    return stack, profile
+
+
+def patchifyTile(tiff_files, output_folder = "/home/umer/projects/vector_studio/icons/cropmapping-server-two/tempData/patches", save_to_disk=True,
+                 patch_size=224, stride=None, overlap=0, pad_edges=False):
+    # stride defaults to patch_size - overlap; pad_edges zero-pads the bottom/right edges so the
+    # grid covers the whole tile instead of dropping the remainder (76 px on a 3660 px HLS tile)
+    stride = stride or patch_size - overlap
 
     def create_patches(tiff_files):
-        all_patches = []
-        
-        # Read each band and create patches
-        for file in tiff_files:
-            patches = []
-            with rasterio.open(file) as src:
-                img = src.read(1)  # Read the first band
-                profile = src.profile  # Get the profile for metadata
-                
-                # Create patches
-                # Get dimensions of the image
-                height, width = img.shape
-                
-                count = 0
-                # Create patches of size patch_size x patch_size
-                for i in range(0, height - patch_size + 1, patch_size):
-                    for j in range(0, width - patch_size + 1, patch_size):
-                        patch = img[i:i + patch_size, j:j + patch_size]
-                        count += 1
-                        patches.append(patch)
-
-                all_patches.append(patches)
-        
-        # Iterate through each list of arrays
-        all_data = []
-        for data_list in all_patches:
-            # Convert the list of arrays to a NumPy array and append to all_data
-            all_data.append(np.array(data_list))
-
-        # Stack the arrays along a new axis to get the desired shape
-        result = np.stack(all_data, axis=-1)  # This will give you shape (256, 224, 224, 18)
-        print(result.shape)
-        reshaped_result = np.transpose(result, (0, 3, 1, 2))
-        return reshaped_result, profile
+        with rasterio.open(tiff_files[0]) as src:
+            height, width = src.height, src.width
+
+        _, padded_height = patch_grid_size(height, patch_size, stride, pad_edges)
+        _, padded_width = patch_grid_size(width, patch_size, stride, pad_edges)
+        # Files repeated in the band stack (a single scene standing in for
+        # several time steps) are read once and broadcast per patch
+        unique_files, channels = unique_channels(tiff_files)
+        stack, profile = read_band_stack(
+            unique_files, (max(padded_height, height), max(padded_width, width))
+        )
+        if len(unique_files) == len(tiff_files):
+            channels = None
+
+        patches = PatchGrid(stack, patch_size, stride, (height, width), channels)
+        print(patches.shape)  # e.g. (256, 18, 224, 224)
+        return patches, profile
 
     def save_patches(patches, profile, output_folder):
         if not os.path.exists(output_folder):
             os.makedirs(output_folder)
-        
+
         # Save each patch as a separate TIFF file
-        for i in range(patches.shape[0]):
-            patch = patches[i, :, :, :]  # Select the ith patch
+        for i in range(len(patches)):
+            patch = patches[i]  # Select the ith patch
             patch_filename = os.path.join(output_folder, f"patch_{i}.tif")
-            
+
             # Update the profile for saving
             new_profile = profile.copy()
             new_profile.update({
@@ -58,16 +153,15 @@ def patchifyTile(tiff_files, output_folder = "/home/umer/projects/vector_studio/
                 'count': patch.shape[0],
                 'transform': profile['transform']  # Retain original transform
             })
-            
+
             with rasterio.open(patch_filename, 'w', **new_profile) as dst:
                 dst.write(patch)
 
     patches, profile = create_patches(tiff_files)
-    print(patches.shape)
-    
+
     if save_to_disk:
         save_patches(patches, profile, output_folder)
         return output_folder, len(patches), patches.shape
     else:
         # Return patches directly for in-memory processing
-        return patches, profile
\ No newline at end of file
+        return patches, profile
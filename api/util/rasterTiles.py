@@ -0,0 +1,191 @@
+import os
+import glob
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.transform import from_bounds
+from rasterio.warp import reproject, transform_bounds
+
+from api.util.palette import CLASS_COLORS, encode_paletted_png
+from api.util.tileMath import tile_bounds
+from api.util.runManifest import MANIFEST_FILE
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+
+# Rendered tiles are stored per run and run version under here
+TILE_CACHE_DIR = os.path.join(ROOT_DIR, 'tempData', 'tiles', 'raster')
+
+# Bytes of encoded tiles kept in memory across all runs (least recently used dropped first)
+MEMORY_CACHE_BYTES = int(os.environ.get('RASTER_TILE_CACHE_BYTES', 64 * 1024 ** 2))
+
+MAX_ZOOM = 18
+TILE_SIZE = 256
+
+# Stitched class rasters are uint8 with 255 outside the tile (stitch256masks, tileInference)
+NODATA = 255
+
+WEB_MERCATOR = 'EPSG:3857'
+
+
+def run_tiffs(run_dir):
+    """Classification TIFFs of a map run, from its per-tile metadata, or the stitched TIFFs on disk."""
+    paths = []
+    for fname in sorted(os.listdir(run_dir)):
+        if not fname.endswith('.json') or fname in ('master.json', 'data.json', MANIFEST_FILE):
+            continue
+        with open(os.path.join(run_dir, fname)) as f:
+            meta = json.load(f)
+        tiff = meta.get("classification_tiff") if isinstance(meta, dict) else None
+        if tiff:
+            paths.append(os.path.abspath(os.path.join(run_dir, tiff)))
+    if not paths:
+        paths = sorted(glob.glob(os.path.join(run_dir, 'stitched_tile_*.tif*')))
+    return [path for path in paths if os.path.exists(path)]
+
+
+class RasterSource:
+    """One classification TIFF: its web mercator footprint and the overview levels it carries."""
+
+    def __init__(self, path):
+        self.path = path
+        with rasterio.open(path) as src:
+            self.crs = src.crs
+            self.res = src.res[0]
+            self.nodata = NODATA if src.nodata is None else src.nodata
+            # Decimation factor of each overview level, finest first
+            self.overviews = src.overviews(1)
+            self.bounds = transform_bounds(src.crs, WEB_MERCATOR, *src.bounds)
+
+    def intersects(self, bounds):
+        left, bottom, right, top = bounds
+        return not (right <= self.bounds[0] or left >= self.bounds[2] or top <= self.bounds[1] or bottom >= self.bounds[3])
+
+    def overview_level(self, bounds, size=TILE_SIZE):
+        """The coarsest overview still at least as fine as a tile pixel over bounds, or None for full resolution."""
+        left, bottom, right, top = transform_bounds(WEB_MERCATOR, self.crs, *bounds)
+        pixels_per_tile_pixel = (right - left) / size / self.res
+        level = None
+        for i, factor in enumerate(self.overviews):
+            if factor <= pixels_per_tile_pixel:
+                level = i
+        return level
+
+    def read_into(self, out, bounds):
+        """Reproject the part of the source under bounds into out, filling only pixels still NODATA."""
+        level = self.overview_level(bounds)
+        open_options = {} if level is None else {"OVERVIEW_LEVEL": level}
+        tile = np.full(out.shape, NODATA, dtype=np.uint8)
+        with rasterio.open(self.path, **open_options) as src:
+            # GDAL's warper only reads the source blocks under the tile
+            reproject(
+                source=rasterio.band(src, 1),
+                destination=tile,
+                src_nodata=self.nodata,
+                dst_transform=from_bounds(*bounds, out.shape[1], out.shape[0]),
+                dst_crs=WEB_MERCATOR,
+                dst_nodata=NODATA,
+                resampling=Resampling.nearest,
+            )
+        empty = out == NODATA
+        out[empty] = tile[empty]
+
+
+class RunTiles:
+    """The classification TIFFs of one map run, identified by the run directory's mtime."""
+
+    def __init__(self, run_dir, version):
+        self.version = version
+        self.sources = [RasterSource(path) for path in run_tiffs(run_dir)]
+
+    def render(self, z, x, y, size=TILE_SIZE):
+        """Class raster of a tile, NODATA where no TIFF covers it; None if no TIFF touches the tile."""
+        bounds = tile_bounds(z, x, y)
+        sources = [source for source in self.sources if source.intersects(bounds)]
+        if not sources:
+            return None
+        out = np.full((size, size), NODATA, dtype=np.uint8)
+        # Where tiles overlap, the first one wins
+        for source in sources:
+            source.read_into(out, bounds)
+        return out
+
+
+class RasterTiles:
+    """XYZ PNG tiles of the classification rasters of map runs, rendered on demand.
+
+    Encoded tiles are kept in a bounded in-memory LRU and written to
+    cache_dir/<run>/<run version>/z/x/y.png, so a tile is rendered once per
+    run; a run directory whose contents change starts a fresh cache. Each
+    tile reads only the overview level matching its zoom, when the TIFFs
+    carry overviews.
+    """
+
+    def __init__(self, mapdata_dir, cache_dir=TILE_CACHE_DIR, memory_bytes=MEMORY_CACHE_BYTES, color_map=CLASS_COLORS):
+        self.mapdata_dir = mapdata_dir
+        self.cache_dir = cache_dir
+        self.memory_bytes = memory_bytes
+        self.color_map = color_map
+        self._runs = {}
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._lock = threading.Lock()
+        self._empty = encode_paletted_png(np.full((TILE_SIZE, TILE_SIZE), NODATA, dtype=np.uint8), color_map, NODATA)
+
+    def run(self, timestamp):
+        """Sources of a run, reloaded when the run directory changes; raises FileNotFoundError for unknown runs."""
+        run_dir = os.path.join(self.mapdata_dir, timestamp)
+        if timestamp in ('', '.', '..') or os.path.basename(timestamp) != timestamp or not os.path.isdir(run_dir):
+            raise FileNotFoundError(run_dir)
+        version = os.stat(run_dir).st_mtime_ns
+        run = self._runs.get(timestamp)
+        if run is None or run.version != version:
+            with self._lock:
+                run = self._runs.get(timestamp)
+                if run is None or run.version != version:
+                    run = RunTiles(run_dir, version)
+                    self._runs[timestamp] = run
+                    print(f"Loaded {len(run.sources)} classification TIFFs for tiles of {timestamp}")
+        return run
+
+    def _remember(self, key, data):
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = data
+            self._memory_used += len(data)
+            while self._memory_used > self.memory_bytes and self._memory:
+                _, dropped = self._memory.popitem(last=False)
+                self._memory_used -= len(dropped)
+
+    def tile(self, timestamp, z, x, y):
+        """PNG bytes of a tile of a run (fully transparent outside its rasters)."""
+        run = self.run(timestamp)
+        key = (timestamp, run.version, z, x, y)
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return data
+
+        cache_path = os.path.join(self.cache_dir, timestamp, str(run.version), str(z), str(x), f"{y}.png")
+        if os.path.exists(cache_path):
+            with open(cache_path, 'rb') as f:
+                data = f.read()
+        else:
+            classes = run.render(z, x, y)
+            if classes is None or (classes == NODATA).all():
+                # Nothing to store: empty tiles are all the same bytes
+                return self._empty
+            data = encode_paletted_png(classes, self.color_map, NODATA)
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            partial = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.part"
+            with open(partial, 'wb') as f:
+                f.write(data)
+            os.replace(partial, cache_path)
+
+        self._remember(key, data)
+        return data
@@ -0,0 +1,363 @@
+import os
+import json
+import math
+import multiprocessing
+from xml.sax.saxutils import escape
+from concurrent.futures import ProcessPoolExecutor
+
+import rasterio
+from rasterio.crs import CRS
+from rasterio.transform import Affine
+from rasterio.shutil import copy as copy_dataset
+from rasterio.windows import Window
+from rasterio.features import geometry_mask
+import geopandas as gpd
+from shapely.ops import unary_union
+
+from api.util.palette import CLASS_COLORS, WHEAT_COLORS, COTTON_COLORS, build_lut, build_palette, colorize
+from api.util.zonalStats import zone_raster, zonal_class_counts
+from api.util.runManifest import MANIFEST_FILE
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+
+# The mosaic is a VRT over the stitched tiles, written here and opened by every render worker
+MOSAIC_DIR = os.path.join(ROOT_DIR, 'tempData', 'mosaics')
+RENDER_WORKERS = int(os.environ.get('DISTRICT_RENDER_WORKERS', os.cpu_count() or 1))
+
+# Rows read, clipped and colorized at a time, so memory is bounded by the mosaic width, not its size
+BLOCK_ROWS = 1024
+
+# Mosaic fill outside the tiles and clip fill outside a region; class 0 is a real class
+NODATA = -1
+
+# per‐pixel area (30m × 30m → acres)
+PIXEL_AREA_ACRES = (30 * 30) / 4046.85642 / 2
+
+CROP_CLASSES = [3, 4, 8, 9, 12]
+LANDUSE_GROUPS = {
+    "Natural": [1, 2, 7],
+    "Urban/Barren": [6, 13, 0],
+}
+
+# Per season: the main crop the crop classes are reported (and colored) as
+SEASONS = {
+    "Jan-Apr": {
+        "color_map": WHEAT_COLORS,
+        "crop_groups": {"Wheat": CROP_CLASSES, "Cotton": [], "Others": [10, 5, 11]},
+    },
+    "Jun-Dec": {
+        "color_map": COTTON_COLORS,
+        "crop_groups": {"Wheat": [], "Cotton": CROP_CLASSES, "Others": [10, 5, 11]},
+    },
+}
+
+# Crop grouping for seasons not in SEASONS (e.g. month names), which are then only used in output names
+DEFAULT_SEASON = "Jan-Apr"
+
+# Per province: its boundary, and where its districts come from
+REGIONS = {
+    "Punjab": {
+        "boundary": os.path.join(ROOT_DIR, 'punjab.json'),
+        "districts": os.path.join(ROOT_DIR, 'districts_cleaned.json'),
+        "province_field": ("NAME_1", "Punjab"),
+        "name_field": "NAME_3",
+    },
+    "Sindh": {
+        "boundary": os.path.join(ROOT_DIR, 'sindh.json'),
+        "districts": os.path.join(ROOT_DIR, 'districts_cleaned.json'),
+        "province_field": ("NAME_1", "Sind"),
+        "name_field": "NAME_3",
+    },
+}
+
+
+def region_config(region, season, default_season=DEFAULT_SEASON, **overrides):
+    """Merged region and season config; keyword arguments that are not None override it.
+
+    A season missing from SEASONS takes the colors and crop groups of default_season.
+    """
+    if region not in REGIONS:
+        raise ValueError(f"Unknown region {region!r}, expected one of {list(REGIONS)}")
+    if season not in SEASONS:
+        print(f"Season {season!r} is not one of {list(SEASONS)}, using the {default_season} crop groups")
+        season = default_season
+    config = dict(REGIONS[region], **SEASONS[season])
+    config.update({key: value for key, value in overrides.items() if value is not None})
+    return config
+
+
+def read_tile_metas(tile_json_dir):
+    """Per-tile metadata JSONs of a map run.
+
+    master.json, data.json and the run manifest are skipped, as is any other
+    JSON that does not name a classification TIFF.
+    """
+    tile_meta_list = []
+    for fname in os.listdir(tile_json_dir):
+        if not fname.lower().endswith('.json'):
+            continue
+        if fname in ('master.json', 'data.json', MANIFEST_FILE):
+            continue
+        path = os.path.join(tile_json_dir, fname)
+        with open(path) as f:
+            meta = json.load(f)
+        if isinstance(meta, dict) and "classification_tiff" in meta:
+            tile_meta_list.append(meta)
+
+    if not tile_meta_list:
+        raise RuntimeError("No valid tile JSON files found in " + tile_json_dir)
+    return tile_meta_list
+
+
+SOURCE_TEMPLATE = """
+    <ComplexSource>
+      <SourceFilename relativeToVRT="0">{path}</SourceFilename>
+      <SourceBand>1</SourceBand>
+      <SrcRect xOff="0" yOff="0" xSize="{width}" ySize="{height}"/>
+      <DstRect {dst_rect}/>{nodata}
+    </ComplexSource>"""
+
+
+def build_mosaic(tile_json_dir, vrt_path):
+    """Describe a run's classification tiles as one EPSG:4326 virtual mosaic, without reading them.
+
+    Each tile is placed by the WGS84 bounds in its metadata, at the
+    resolution of the first tile (as rasterio.merge.merge does); where
+    tiles overlap the first one wins. Pixels no tile covers, or that are
+    nodata in their tile, read as NODATA. Returns (shape, transform).
+    """
+    tiles = []
+    for meta in read_tile_metas(tile_json_dir):
+        tiff_path = os.path.abspath(os.path.join(tile_json_dir, meta["classification_tiff"]))
+        # extract [png_name, lat_max, lat_min, lon_max, lon_min]
+        _, lat_max, lat_min, lon_max, lon_min = meta["tiles"][0]
+        with rasterio.open(tiff_path) as src:
+            tiles.append((tiff_path, src.width, src.height, src.nodata, (lon_min, lat_min, lon_max, lat_max)))
+
+    _, width, height, _, (west, south, east, north) = tiles[0]
+    res_x, res_y = (east - west) / width, (north - south) / height
+    west = min(bounds[0] for *_, bounds in tiles)
+    south = min(bounds[1] for *_, bounds in tiles)
+    east = max(bounds[2] for *_, bounds in tiles)
+    north = max(bounds[3] for *_, bounds in tiles)
+    shape = (int(round((north - south) / res_y)), int(round((east - west) / res_x)))
+    transform = Affine.translation(west, north) * Affine.scale(res_x, -res_y)
+
+    sources = []
+    # Later VRT sources paint over earlier ones, so list them last tile first
+    for tiff_path, width, height, nodata, (lon_min, lat_min, lon_max, lat_max) in reversed(tiles):
+        dst_rect = (
+            f'xOff="{(lon_min - west) / res_x!r}" yOff="{(north - lat_max) / res_y!r}" '
+            f'xSize="{(lon_max - lon_min) / res_x!r}" ySize="{(lat_max - lat_min) / res_y!r}"'
+        )
+        source_nodata = f"\n      <NODATA>{nodata!r}</NODATA>" if nodata is not None else ""
+        sources.append(SOURCE_TEMPLATE.format(
+            path=escape(tiff_path), width=width, height=height, dst_rect=dst_rect, nodata=source_nodata
+        ))
+
+    vrt = f"""<VRTDataset rasterXSize="{shape[1]}" rasterYSize="{shape[0]}">
+  <SRS>{escape(CRS.from_epsg(4326).to_wkt())}</SRS>
+  <GeoTransform>{", ".join(repr(v) for v in transform.to_gdal())}</GeoTransform>
+  <VRTRasterBand dataType="Int16" band="1">
+    <NoDataValue>{NODATA}</NoDataValue>{"".join(sources)}
+  </VRTRasterBand>
+</VRTDataset>
+"""
+    with open(vrt_path, 'w') as f:
+        f.write(vrt)
+    print(f"Mosaic of {len(tiles)} tiles: {shape[1]}x{shape[0]} px ({vrt_path})")
+    return shape, transform
+
+
+def read_geometries(path, field=None):
+    """Repaired, valid geometries of a GeoJSON, optionally filtered on a (column, value) field."""
+    gdf = gpd.read_file(path, force_pyogrio=False)  # fall back to Fiona
+    if field:
+        gdf = gdf[gdf[field[0]] == field[1]]
+    # Repair invalid geometries with zero-width buffer
+    gdf["geometry"] = gdf.geometry.buffer(0)
+    # Drop any remaining invalid geometries
+    gdf = gdf[gdf.is_valid]
+    if gdf.empty:
+        raise RuntimeError(f"No valid geometry found in {path}" + (f" with {field[0]} == {field[1]!r}" if field else ""))
+    return gdf
+
+
+def summarize(cls_counts, groups):
+    """Acres per group from per-class pixel counts."""
+    return {
+        label: round(sum(cls_counts.get(c, 0) for c in classes) * PIXEL_AREA_ACRES)
+        for label, classes in groups.items()
+    }
+
+
+def area_window(geometry, transform, shape):
+    """Window of the grid covering geometry, as rasterio.mask.mask(crop=True) crops it; None if it misses the grid."""
+    left, bottom, right, top = geometry.bounds
+    col_start, row_start = ~transform * (left, top)
+    col_stop, row_stop = ~transform * (right, bottom)
+    row_start, col_start = max(0, math.floor(row_start)), max(0, math.floor(col_start))
+    row_stop, col_stop = min(shape[0], math.ceil(row_stop)), min(shape[1], math.ceil(col_stop))
+    if row_stop <= row_start or col_stop <= col_start:
+        return None
+    return Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+
+
+def write_area_png(mosaic, window, geometry, png_path, color_map, paletted=True, block_rows=BLOCK_ROWS):
+    """Clip and colorize a window of the mosaic into a PNG, block by block.
+
+    Pixels outside geometry become NODATA and stay transparent. Blocks are
+    streamed into a temporary GeoTIFF next to the PNG, which GDAL then
+    copies to PNG (with its .aux.xml georeference) scanline by scanline;
+    the PNG driver cannot be written block-wise itself.
+    """
+    transform = mosaic.window_transform(window)
+    profile = {
+        "driver": "GTiff",
+        "height": window.height,
+        "width": window.width,
+        "dtype": "uint8",
+        "transform": transform,
+        "crs": "EPSG:4326",
+    }
+    if paletted:
+        index_lut, colormap = build_palette(color_map, NODATA)
+        # The PNG driver marks the nodata palette entry transparent (tRNS)
+        profile.update(count=1, nodata=int(index_lut[NODATA]))
+    else:
+        color_lut = build_lut(color_map, alpha=True, nodata=NODATA)
+        profile.update(count=4)
+
+    tmp_path = f"{png_path}.part.tif"
+    try:
+        with rasterio.open(tmp_path, 'w', **profile) as dst:
+            if paletted:
+                dst.write_colormap(1, colormap)
+            for row in range(0, window.height, block_rows):
+                height = min(block_rows, window.height - row)
+                block_window = Window(window.col_off, window.row_off + row, window.width, height)
+                arr = mosaic.read(1, window=block_window)
+                outside = geometry_mask([geometry], out_shape=arr.shape, transform=mosaic.window_transform(block_window))
+                arr[outside] = NODATA
+                out_window = Window(0, row, window.width, height)
+                if paletted:
+                    dst.write(colorize(arr, index_lut), 1, window=out_window)
+                else:
+                    dst.write(colorize(arr, color_lut).transpose(2, 0, 1), window=out_window)
+        copy_dataset(tmp_path, png_path, driver="PNG")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return png_path
+
+
+def render_area(mosaic_path, geometry, cls_counts, png_path, json_path, description,
+                color_map, crop_groups, paletted=True):
+    """Render one province or district from the shared mosaic; runs in a worker process.
+
+    Writes the area PNG (with its .aux.xml georeference) and JSON summary,
+    and returns the (crop, land use) summary.
+    """
+    with rasterio.open(mosaic_path) as mosaic:
+        # a) Window of the mosaic covering the area
+        window = area_window(geometry, mosaic.transform, mosaic.shape)
+
+        # b, c) Clip, colorize and save PNG, nodata (-1) pixels stay transparent
+        if window is None:
+            print(f"Skipping PNG for {os.path.basename(png_path)}: area is outside the mosaic")
+        else:
+            write_area_png(mosaic, window, geometry, png_path, color_map, paletted)
+
+    # d, e) Summarize the area's pixel counts, from the zonal pass, into areas
+    crop_data = summarize(cls_counts, crop_groups)
+    land_data = summarize(cls_counts, LANDUSE_GROUPS)
+
+    # f) Write the area JSON
+    info = {
+        "description": description,
+        "cropTypeData": crop_data,
+        "landUseData": land_data
+    }
+    with open(json_path, 'w') as jf:
+        json.dump(info, jf, indent=2)
+    return crop_data, land_data
+
+
+def render_region(tile_json_dir, output_png_dir, output_json_dir, region, season, year,
+                  boundary=None, districts=None, province_map=True, district_maps=True,
+                  paletted=True, workers=RENDER_WORKERS, default_season=DEFAULT_SEASON):
+    """Render a province map, its district maps and their statistics from one mosaic.
+
+    The region config (REGIONS, SEASONS) supplies the geometry sources,
+    color map and crop groups; boundary and districts override its GeoJSON
+    paths, and default_season picks the crop groups for seasons missing
+    from SEASONS. Class counts of every area come from a single zonal pass, and
+    the province statistics are the sum of its districts' counts when
+    districts are rendered. Outputs are named {season}_{year}_{name}.png/json.
+    """
+    config = region_config(region, season, default_season, boundary=boundary, districts=districts)
+    color_map, crop_groups = config["color_map"], config["crop_groups"]
+
+    # 1. Load the areas to render as (name, label, geometry)
+    province_areas = []
+    if province_map:
+        province = read_geometries(config["boundary"])
+        province_areas.append((region, region, unary_union(list(province.geometry))))
+    district_areas = []
+    if district_maps:
+        district_gdf = read_geometries(config["districts"], config["province_field"])
+        for _, row in district_gdf.iterrows():
+            label = row[config["name_field"]]
+            district_areas.append((label.replace(" ", "_"), label, row.geometry))
+    areas = province_areas + district_areas
+    if not areas:
+        raise ValueError("Nothing to render: both province_map and district_maps are off")
+
+    # 2. Describe the mosaic once for every output; tiles are only read block by block
+    os.makedirs(MOSAIC_DIR, exist_ok=True)
+    mosaic_path = os.path.join(MOSAIC_DIR, f"{region}_{season}_{year}_{os.getpid()}.vrt")
+    mosaic_shape, mosaic_transform = build_mosaic(tile_json_dir, mosaic_path)
+
+    try:
+        # 3. Area x class pixel counts in one pass over the mosaic blocks; zone i + 1 is the i-th area
+        counted = district_areas or province_areas
+        zones = zone_raster([geometry for _, _, geometry in counted], mosaic_shape, mosaic_transform)
+        with rasterio.open(mosaic_path) as mosaic:
+            def read_rows(row, height):
+                return mosaic.read(1, window=Window(0, row, mosaic.width, height))
+            counts = zonal_class_counts(zones, read_rows, len(counted), len(CLASS_COLORS), nodata=NODATA)
+        area_counts = {name: counts[zone] for zone, (name, _, _) in enumerate(counted, start=1)}
+        if province_areas and district_areas:
+            # Province rollup: the reduction of its districts' counts
+            area_counts[region] = counts[1:].sum(axis=0)
+
+        # 4. Prepare output directories
+        os.makedirs(output_png_dir, exist_ok=True)
+        os.makedirs(output_json_dir, exist_ok=True)
+
+        # 5. Render every area in parallel: clip, colorize, PNG (+ .aux.xml) and JSON
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = [
+                pool.submit(
+                    render_area,
+                    mosaic_path,
+                    geometry,
+                    dict(enumerate(area_counts[name].tolist())),
+                    os.path.join(output_png_dir, f"{season}_{year}_{name}.png"),
+                    os.path.join(output_json_dir, f"{season}_{year}_{name}.json"),
+                    f"Land and Crop data for {label} for {season} {year}",
+                    color_map,
+                    crop_groups,
+                    paletted,
+                )
+                for name, label, geometry in areas
+            ]
+            summaries = {name: future.result() for (name, _, _), future in zip(areas, futures)}
+    finally:
+        os.remove(mosaic_path)
+
+    print("Processing complete.")
+    print(f"  - PNGs in:  {output_png_dir}")
+    print(f"  - JSONs in: {output_json_dir}")
+    return summaries
@@ -0,0 +1,152 @@
+import os
+import json
+import glob
+import shutil
+import hashlib
+import threading
+from datetime import datetime
+
+MANIFEST_FILE = 'manifest.json'
+
+# Pipeline stages of one tile, in order
+STAGES = ('download', 'process')
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+def tile_key(scene_ids, timestamps, model_sha256, sliding_window):
+    """Fingerprint of everything a tile's outputs depend on."""
+    payload = json.dumps({
+        "scenes": scene_ids,
+        "timestamps": timestamps,
+        "model": model_sha256,
+        "sliding_window": sliding_window,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class RunManifest:
+    """Per-run record of each tile's inputs, stage status and output artifacts.
+
+    Stored as manifest.json in the run's mapdata directory and rewritten
+    atomically after every change, so a rerun of the same run name can skip
+    finished tiles and stages, and other runs can reuse finished tiles whose
+    input key matches.
+    """
+
+    def __init__(self, path, data):
+        self.path = path
+        self.data = data
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, output_dir, **run_info):
+        path = os.path.join(output_dir, MANIFEST_FILE)
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            print(f"Resuming run from {path}")
+        else:
+            data = {"created": datetime.now().isoformat(timespec='seconds'), "tiles": {}}
+        data.update(run_info)
+        manifest = cls(path, data)
+        manifest.save()
+        return manifest
+
+    @property
+    def output_dir(self):
+        return os.path.dirname(self.path)
+
+    def save(self):
+        with self._lock:
+            partial = f"{self.path}.part"
+            with open(partial, 'w') as f:
+                json.dump(self.data, f, indent=4)
+            os.replace(partial, self.path)
+
+    def tile(self, tile_name):
+        return self.data["tiles"].get(tile_name)
+
+    def start_tile(self, tile_name, key, scene_ids, timestamps):
+        """Register a tile's inputs; stages recorded for different inputs are reset."""
+        entry = self.tile(tile_name)
+        if entry is None or entry["key"] != key:
+            entry = {
+                "key": key,
+                "scenes": scene_ids,
+                "timestamps": timestamps,
+                "stages": {stage: PENDING for stage in STAGES},
+                "artifacts": {},
+            }
+            self.data["tiles"][tile_name] = entry
+            self.save()
+        return entry
+
+    def set_stage(self, tile_name, stage, status, error=None):
+        entry = self.data["tiles"][tile_name]
+        entry["stages"][stage] = status
+        if error is not None:
+            entry["error"] = error
+        else:
+            entry.pop("error", None)
+        self.save()
+
+    def set_artifacts(self, tile_name, **artifacts):
+        self.data["tiles"][tile_name]["artifacts"].update(artifacts)
+        self.save()
+
+    def stage_done(self, tile_name, stage, key):
+        entry = self.tile(tile_name)
+        return bool(entry) and entry["key"] == key and entry["stages"].get(stage) == DONE
+
+    def completed(self, tile_name, key):
+        """Whether the tile finished with these inputs and its output files are still there."""
+        if not self.stage_done(tile_name, 'process', key):
+            return False
+        return artifacts_exist(self.tile(tile_name), self.output_dir)
+
+
+def artifact_files(entry):
+    """Output file names of a tile entry, relative to its run directory."""
+    artifacts = entry.get("artifacts", {})
+    return [artifacts[name] for name in ('png_file', 'tiff_file', 'json_file') if artifacts.get(name)]
+
+
+def artifacts_exist(entry, run_dir):
+    files = artifact_files(entry)
+    return bool(files) and all(os.path.exists(os.path.join(run_dir, name)) for name in files)
+
+
+def find_reusable_tile(key, mapdata_dir, exclude_dir=None):
+    """Find a finished tile with the same input key in any run under mapdata_dir.
+
+    Returns (run_dir, tile entry) or (None, None).
+    """
+    for manifest_path in glob.glob(os.path.join(mapdata_dir, '*', MANIFEST_FILE)):
+        run_dir = os.path.dirname(manifest_path)
+        if exclude_dir and os.path.abspath(run_dir) == os.path.abspath(exclude_dir):
+            continue
+        try:
+            with open(manifest_path) as f:
+                tiles = json.load(f)["tiles"]
+        except (OSError, ValueError, KeyError):
+            continue
+        for entry in tiles.values():
+            if entry.get("key") == key and entry["stages"].get('process') == DONE and artifacts_exist(entry, run_dir):
+                return run_dir, entry
+    return None, None
+
+
+def copy_artifacts(entry, source_dir, output_dir):
+    """Link (or copy) a finished tile's output files into another run directory."""
+    for name in artifact_files(entry):
+        source = os.path.join(source_dir, name)
+        target = os.path.join(output_dir, name)
+        if os.path.exists(target):
+            os.remove(target)
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)
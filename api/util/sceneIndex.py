@@ -0,0 +1,163 @@
+import os
+import re
+import json
+import time
+import hashlib
+
+# HLS file names look like HLS.S30.T42RXT.2025004T055231.v2.0.B02.tif
+HLS_FILE_PATTERN = re.compile(r'HLS\.(\w+)\.T(\w{5})\.(\d{4})(\d{3})T(\d{6})\.v[\d.]+\.(\w+)\.tif$')
+
+SEARCH_CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'tempData', 'search_cache'
+)
+SEARCH_TTL_HOURS = float(os.environ.get('HLS_SEARCH_TTL_HOURS', 24))
+
+
+def normalize_tile(tile_name):
+    """'T42RXT' and '42RXT' both refer to MGRS tile 42RXT."""
+    return tile_name[1:] if tile_name and len(tile_name) == 6 and tile_name[0] == 'T' else tile_name
+
+
+def granule_cloud_cover(result):
+    """Cloud cover percentage reported in a granule's UMM metadata, if any."""
+    umm = result['umm'] if 'umm' in result else {}
+    if umm.get('CloudCover') is not None:
+        return float(umm['CloudCover'])
+    for attribute in umm.get('AdditionalAttributes', []):
+        if attribute.get('Name') == 'CLOUD_COVERAGE' and attribute.get('Values'):
+            return float(attribute['Values'][0])
+    return None
+
+
+def parse_scene(result):
+    """Parse an earthaccess granule into a plain scene record with its per-band URLs."""
+    scene = None
+    for url in result.data_links():
+        match = HLS_FILE_PATTERN.search(url)
+        if not match:
+            continue
+        product, tile, year, doy, hhmmss, band = match.groups()
+        if scene is None:
+            scene = {
+                "granule_id": f"HLS.{product}.T{tile}.{year}{doy}T{hhmmss}",
+                "tile": tile,
+                "year": year,
+                "doy": doy,
+                "time": hhmmss,
+                "cloud_cover": granule_cloud_cover(result),
+                "bands": {},
+            }
+        scene["bands"][band] = url
+    return scene
+
+
+class SceneIndex:
+    """HLS search results parsed once and indexed by tile, acquisition date/time and band.
+
+    Lookups accept the timestamp formats used in the timestamp tables: a
+    3-digit day of year ('098') or day of year and time ('098T055231').
+    As when scanning search results in order, the first matching scene wins.
+    """
+
+    def __init__(self, scenes):
+        self.scenes = scenes
+        self._by_tile = {}
+        self._by_timestamp = {}
+        for scene in scenes:
+            self._by_tile.setdefault(scene["tile"], []).append(scene)
+            for timestamp in (scene["doy"], f"{scene['doy']}T{scene['time']}"):
+                self._by_timestamp.setdefault((scene["tile"], timestamp), scene)
+                self._by_timestamp.setdefault((None, timestamp), scene)
+
+    @classmethod
+    def from_results(cls, results):
+        scenes = [scene for scene in (parse_scene(result) for result in results or []) if scene]
+        return cls(scenes)
+
+    def __len__(self):
+        return len(self.scenes)
+
+    def tiles(self):
+        return list(self._by_tile)
+
+    def for_tile(self, tile_name):
+        """All scenes of a tile, in search order."""
+        return self._by_tile.get(normalize_tile(tile_name), [])
+
+    def subset(self, tile_name):
+        """A new index holding only the scenes of one tile."""
+        return SceneIndex(self.for_tile(tile_name))
+
+    def find(self, timestamp, tile_name=None):
+        """The first scene acquired at timestamp, optionally restricted to one tile."""
+        return self._by_timestamp.get((normalize_tile(tile_name), timestamp))
+
+    def scene_ids(self, timestamps):
+        """Granule IDs downloadTile uses for a timestamps entry, without downloading anything.
+
+        None picks the first, middle and last scenes; composite ranges list
+        every timestamp of every range.
+        """
+        if timestamps is None:
+            if len(self.scenes) < 3:
+                return []
+            chosen = [self.scenes[0], self.scenes[len(self.scenes) // 2], self.scenes[-1]]
+        else:
+            if isinstance(timestamps, str):
+                timestamps = (timestamps,)
+            flat = [t for entry in timestamps for t in (entry if isinstance(entry, (tuple, list)) else (entry,))]
+            chosen = [self.find(timestamp) for timestamp in flat]
+        return [scene["granule_id"] if scene else None for scene in chosen]
+
+    def band_urls(self, scene, bands):
+        """URLs of the requested bands of a scene, in the order of bands."""
+        return [scene["bands"][band] for band in bands if band in scene["bands"]]
+
+    def to_json(self):
+        return {"scenes": self.scenes}
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f"{path}.part"
+        with open(partial, 'w') as f:
+            json.dump(self.to_json(), f)
+        os.replace(partial, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f)["scenes"])
+
+
+def search_cache_path(bounding_box, temporal_range, short_name, cloud_cover, cache_dir=SEARCH_CACHE_DIR):
+    key = json.dumps([list(bounding_box), list(temporal_range), short_name, list(cloud_cover)])
+    return os.path.join(cache_dir, hashlib.sha256(key.encode('utf-8')).hexdigest()[:16] + '.json')
+
+
+def search_scene_index(
+        bounding_box,
+        temporal_range,
+        short_name='HLSS30',
+        cloud_hosted=True,
+        cloud_cover=(0, 20),
+        ttl_hours=SEARCH_TTL_HOURS,
+        cache_dir=SEARCH_CACHE_DIR
+        ):
+    """Search HLS data and index it, reusing a cached index younger than ttl_hours."""
+    path = search_cache_path(bounding_box, temporal_range, short_name, cloud_cover, cache_dir)
+    if os.path.exists(path) and time.time() - os.path.getmtime(path) < ttl_hours * 3600:
+        index = SceneIndex.load(path)
+        print(f"Loaded {len(index)} cached search results from {path}")
+        return index
+
+    # Imported here so cached runs never need to authenticate with Earthdata
+    from api.util.downloadTileEarthAccess import search_hls_data
+    results = search_hls_data(bounding_box, temporal_range, short_name=short_name,
+                              cloud_hosted=cloud_hosted, cloud_cover=cloud_cover)
+    if not results:
+        return None
+
+    index = SceneIndex.from_results(results)
+    index.save(path)
+    print(f"Indexed {len(index)} scenes over {len(index.tiles())} tiles, cached to {path}")
+    return index
@@ -0,0 +1,158 @@
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import rasterio
+from rasterio.enums import Resampling
+
+from api.util.granuleCache import granule_cache, MAX_WORKERS
+
+FMASK_BAND = 'Fmask'
+
+# HLS Fmask bits 1-3: cloud, adjacent to cloud/shadow, cloud shadow
+FMASK_INVALID_BITS = 0b1110
+FMASK_FILL = 255
+
+# Fmask is read at 1/16 resolution (229 px for a 3660 px tile), from the COG overviews when present
+OVERVIEW_FACTOR = 16
+
+# The model takes three acquisitions per tile
+NUM_WINDOWS = 3
+VALID_FRACTION_THRESHOLD = 0.9
+
+# Only the least cloudy scenes of each window (by granule metadata) get their Fmask read
+CANDIDATES_PER_WINDOW = 4
+
+
+def scene_date(scene):
+    return datetime.strptime(scene["year"] + scene["doy"], '%Y%j')
+
+
+def scene_timestamp(scene):
+    """Timestamp in the 'DDDTHHMMSS' form understood by downloadTile."""
+    return f"{scene['doy']}T{scene['time']}"
+
+
+def cloud_cover(scene):
+    return scene["cloud_cover"] if scene.get("cloud_cover") is not None else 100.0
+
+
+def split_windows(scenes, num_windows=NUM_WINDOWS):
+    """Split scenes into num_windows equal spans of acquisition date, each in date order."""
+    scenes = sorted(scenes, key=scene_date)
+    windows = [[] for _ in range(num_windows)]
+    if not scenes:
+        return windows
+    first, last = scene_date(scenes[0]), scene_date(scenes[-1])
+    span = (last - first).total_seconds() or 1
+    for scene in scenes:
+        position = (scene_date(scene) - first).total_seconds() / span
+        windows[min(int(position * num_windows), num_windows - 1)].append(scene)
+    return windows
+
+
+def read_valid_mask(fmask_path, factor=OVERVIEW_FACTOR):
+    """Boolean mask of clear pixels from an Fmask layer, read at 1/factor resolution."""
+    with rasterio.open(fmask_path) as src:
+        out_shape = (max(1, src.height // factor), max(1, src.width // factor))
+        fmask = src.read(1, out_shape=out_shape, resampling=Resampling.nearest)
+    return ((fmask & FMASK_INVALID_BITS) == 0) & (fmask != FMASK_FILL)
+
+
+def scene_valid_masks(scenes, factor=OVERVIEW_FACTOR, max_workers=MAX_WORKERS):
+    """Reduced-resolution clear-pixel masks of scenes, keyed by granule ID.
+
+    Only the small Fmask layers are fetched, in parallel and through the
+    granule cache. Scenes without an Fmask layer are left out.
+    """
+    scenes = [scene for scene in scenes if FMASK_BAND in scene["bands"]]
+
+    def valid_mask(scene):
+        return read_valid_mask(granule_cache.get(scene["bands"][FMASK_BAND]), factor)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        masks = pool.map(valid_mask, scenes)
+    return {scene["granule_id"]: mask for scene, mask in zip(scenes, masks)}
+
+
+def candidate_windows(scene_index, tile_name=None, num_windows=NUM_WINDOWS, per_window=CANDIDATES_PER_WINDOW):
+    """The least cloudy scenes of each date window, by the cloud cover in the granule metadata."""
+    scenes = scene_index.for_tile(tile_name) if tile_name else scene_index.scenes
+    return [sorted(window, key=cloud_cover)[:per_window] for window in split_windows(scenes, num_windows)]
+
+
+def select_window(scenes, masks, valid_fraction_threshold=VALID_FRACTION_THRESHOLD):
+    """Pick the clearest scene of a window, plus a gap-filling partner if it alone is too cloudy.
+
+    Returns (chosen scenes, valid fraction they reach together).
+    """
+    def valid_fraction(scene):
+        mask = masks.get(scene["granule_id"])
+        # Without an Fmask layer fall back to the granule's own cloud cover
+        return float(mask.mean()) if mask is not None else 1 - cloud_cover(scene) / 100
+
+    ranked = sorted(scenes, key=lambda scene: (-valid_fraction(scene), cloud_cover(scene)))
+    best = ranked[0]
+    fraction = valid_fraction(best)
+    if fraction >= valid_fraction_threshold or len(ranked) == 1 or best["granule_id"] not in masks:
+        return [best], fraction
+
+    # Composite with the scene that is clear where the best one is not
+    best_mask = masks[best["granule_id"]]
+    partners = [scene for scene in ranked[1:] if scene["granule_id"] in masks]
+    if not partners:
+        return [best], fraction
+    partner = max(partners, key=lambda scene: (best_mask | masks[scene["granule_id"]]).mean())
+    combined = float((best_mask | masks[partner["granule_id"]]).mean())
+    if combined <= fraction:
+        return [best], fraction
+    return [best, partner], combined
+
+
+def select_timestamps(scene_index, masks, tile_name=None, num_windows=NUM_WINDOWS,
+                      valid_fraction_threshold=VALID_FRACTION_THRESHOLD, per_window=CANDIDATES_PER_WINDOW):
+    """Choose one acquisition (or composite pair) per date window for a tile.
+
+    Returns a timestamps entry in the format downloadTile takes: three
+    timestamps, three (timestamp, timestamp) composite ranges when any
+    window needs gap filling, or a single timestamp when the season has
+    too few windows with scenes. None if the tile has no scenes.
+    """
+    windows = [window for window in candidate_windows(scene_index, tile_name, num_windows, per_window) if window]
+    if not windows:
+        return None
+
+    choices = [select_window(window, masks, valid_fraction_threshold) for window in windows]
+    for window, (chosen, fraction) in zip(windows, choices):
+        label = ' + '.join(scene_timestamp(scene) for scene in chosen)
+        print(f"Tile {tile_name or windows[0][0]['tile']}: {label} ({fraction:.0%} clear of {len(window)} candidates)")
+
+    if len(windows) < num_windows:
+        # Not enough distinct windows for a time series: reuse the clearest single scene
+        chosen, _ = max(choices, key=lambda choice: choice[1])
+        return (scene_timestamp(chosen[0]),)
+
+    if all(len(chosen) == 1 for chosen, _ in choices):
+        return tuple(scene_timestamp(chosen[0]) for chosen, _ in choices)
+
+    # downloadTile composites every window or none, so clear windows pair a scene with itself
+    return tuple(
+        tuple(scene_timestamp(scene) for scene in (chosen if len(chosen) == 2 else chosen * 2))
+        for chosen, _ in choices
+    )
+
+
+def select_province_timestamps(scene_index, tiles, num_windows=NUM_WINDOWS,
+                               valid_fraction_threshold=VALID_FRACTION_THRESHOLD, per_window=CANDIDATES_PER_WINDOW):
+    """Select timestamps for every tile, reading the Fmask of all candidates in one parallel pass."""
+    candidates = [
+        scene
+        for tile_name in tiles
+        for window in candidate_windows(scene_index, tile_name, num_windows, per_window)
+        for scene in window
+    ]
+    print(f"Reading Fmask of {len(candidates)} candidate scenes over {len(tiles)} tiles")
+    masks = scene_valid_masks(candidates)
+    return [
+        select_timestamps(scene_index, masks, tile_name, num_windows, valid_fraction_threshold, per_window)
+        for tile_name in tiles
+    ]
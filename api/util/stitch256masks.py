@@ -5,14 +5,18 @@ import numpy as np
 import tifffile
 import rasterio
 from rasterio.transform import Affine
-from copy import copy
 import glob
 
+from api.util.cog import write_cog, NODATA
+
 def stitch256masks(
     input_folder = '/home/umer/projects/vector_studio/icons/cropmapping-server-two/tempData/patches_masks',
     output_file = '/home/umer/projects/vector_studio/icons/cropmapping-server-two/tempData/finalOutput/stiched_image.png',
     rgb_masks=None,
-    class_masks=None
+    class_masks=None,
+    coords=None,
+    tile_shape=None,
+    source_tiff=None
 ):
     # Check if output folder exists, create if not
     output_dir = os.path.dirname(output_file)
@@ -29,7 +33,25 @@ def stitch256masks(
     # Define the grid size
     grid_size = 16
     
-    if rgb_masks is not None and class_masks is not None:
+    if rgb_masks is not None and class_masks is not None and coords is not None:
+        # Place each mask at its exact pixel offset in the full tile (see PatchGrid.coords)
+        print("Using masks from memory for stitching at patch coordinates")
+        tile_height, tile_width = tile_shape
+
+        stitched_image_array = np.zeros((tile_height, tile_width, 4), dtype=np.uint8)
+        stitched_tiff = np.full((tile_height, tile_width), 255, dtype=np.uint8)
+
+        for rgb_mask, class_mask, (row, col) in zip(rgb_masks, class_masks, coords):
+            # Patches hanging over the padded bottom/right edge are cropped to the tile
+            height = min(class_mask.shape[0], tile_height - row)
+            width = min(class_mask.shape[1], tile_width - col)
+            stitched_image_array[row:row + height, col:col + width, :3] = rgb_mask[:height, :width]
+            stitched_image_array[row:row + height, col:col + width, 3] = 255
+            stitched_tiff[row:row + height, col:col + width] = class_mask[:height, :width]
+
+        stitched_image = Image.fromarray(stitched_image_array, 'RGBA')
+
+    elif rgb_masks is not None and class_masks is not None:
         # Use masks directly from memory
         print("Using masks from memory for stitching")
         
@@ -120,47 +142,40 @@ def stitch256masks(
     stitched_image.save(output_file)
     print(f"Stitched PNG image saved as {output_file}")
     
-    # Find the original georeferenced TIFF to copy metadata
-    source_tifs = glob.glob('/home/umer/projects/vector_studio/icons/cropmapping-server-two/tempData/tiles/*.tif')
+    # Find the original georeferenced TIFF to copy metadata (callers with their own workspace pass it directly)
+    if source_tiff:
+        source_tifs = [source_tiff]
+    else:
+        source_tifs = glob.glob('/home/umer/projects/vector_studio/icons/cropmapping-server-two/tempData/tiles/*.tif')
     if source_tifs:
         # Use the first TIFF file to get georeference information
         with rasterio.open(source_tifs[0]) as src:
-            # Copy the metadata
-            out_meta = copy(src.meta)
-            
-            # Calculate the new transform for the larger stitched image
-            # We need to adjust the transform to account for the upscaling to a 16x16 grid
             src_transform = src.transform
-            
-            # Create a new transform with adjusted resolution
-            new_transform = Affine(
-                src_transform.a / (grid_size * tiff_width / src.width),  # Scale the pixel width
-                src_transform.b,
-                src_transform.c,  # x_min coordinate stays the same
-                src_transform.d,
-                src_transform.e / (grid_size * tiff_height / src.height),  # Scale the pixel height
-                src_transform.f   # y_max coordinate stays the same
-            )
-            
-            # Update the metadata with the new dimensions and transform
-            out_meta.update({
-                'height': stitched_tiff.shape[0],
-                'width': stitched_tiff.shape[1],
-                'transform': new_transform,
-                'dtype': 'uint8',
-                'count': 1,  # Single band for class values
-                'nodata': 255  # Use 255 as nodata value for uint8, as it's within the valid range
-            })
-            
-            # Write the stitched TIFF with georeference information
-            with rasterio.open(output_tiff, 'w', **out_meta) as dest:
-                dest.write(stitched_tiff, 1)
-                print(f"Stitched georeferenced TIFF saved as {output_tiff}")
+
+            if coords is not None:
+                # Masks were placed on the source pixel grid, so its transform applies as is
+                new_transform = src_transform
+            else:
+                # Calculate the new transform for the larger stitched image
+                # We need to adjust the transform to account for the upscaling to a 16x16 grid
+                new_transform = Affine(
+                    src_transform.a / (grid_size * tiff_width / src.width),  # Scale the pixel width
+                    src_transform.b,
+                    src_transform.c,  # x_min coordinate stays the same
+                    src_transform.d,
+                    src_transform.e / (grid_size * tiff_height / src.height),  # Scale the pixel height
+                    src_transform.f   # y_max coordinate stays the same
+                )
+            crs = src.crs
+
+        # Write the stitched class raster as a tiled, compressed COG with overviews (255 as nodata)
+        write_cog(output_tiff, stitched_tiff, crs=crs, transform=new_transform, nodata=NODATA)
+        print(f"Stitched georeferenced COG saved as {output_tiff}")
     else:
         # If no source TIFF was found, save without georeference
         print("Warning: No source GeoTIFF found for georeference metadata")
-        tifffile.imwrite(output_tiff, stitched_tiff)
-        print(f"Stitched TIFF (without georeference) saved as {output_tiff}")
+        write_cog(output_tiff, stitched_tiff, nodata=NODATA)
+        print(f"Stitched COG (without georeference) saved as {output_tiff}")
     
     return output_file
 
@@ -0,0 +1,150 @@
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+from api.model.inference import forward_batches, batch_size_for_budget
+from api.model.registry import OUT_CHANNELS
+from api.util.cog import write_cog
+from api.util.patchifyTileForPrithvi import unique_channels
+
+PATCH_SIZE = 224
+OVERLAP = 64
+
+# Default memory budget for one tile: accumulator, input strip and model batches
+MEMORY_BUDGET_MB = 1024
+
+NODATA = 255
+
+
+def blend_weights(patch_size, mode='gaussian'):
+    """Per-pixel weights for blending overlapping windows, highest at the window center."""
+    if mode == 'gaussian':
+        sigma = patch_size / 8
+        ramp = np.exp(-0.5 * ((np.arange(patch_size) - (patch_size - 1) / 2) / sigma) ** 2)
+    elif mode == 'linear':
+        ramp = 1 - np.abs(np.linspace(-1, 1, patch_size))
+    elif mode == 'uniform':
+        ramp = np.ones(patch_size)
+    else:
+        raise ValueError(f"Unknown blend mode {mode!r}, expected 'gaussian', 'linear' or 'uniform'")
+    # Keep the window border slightly positive so every covered pixel gets a vote
+    ramp = np.maximum(ramp, 1e-3)
+    return np.outer(ramp, ramp).astype(np.float32)
+
+
+def window_offsets(length, patch_size, stride):
+    """Window start offsets covering [0, length), with the last window flush against the end."""
+    if length <= patch_size:
+        return [0]
+    offsets = list(range(0, length - patch_size, stride))
+    offsets.append(length - patch_size)
+    return offsets
+
+
+class BandStackReader:
+    """Reads horizontal strips of a multi-file band stack, one file per model channel.
+
+    A file listed for several channels is opened and read once per strip.
+    """
+
+    def __init__(self, channel_paths):
+        unique_paths, self.channels = unique_channels(channel_paths)
+        self.datasets = [rasterio.open(path) for path in unique_paths]
+        first = self.datasets[0]
+        self.profile = first.profile
+        self.shape = (first.height, first.width)
+        self.dtype = first.dtypes[0]
+
+    def read_rows(self, row, height):
+        """Read rows [row, row + height) of every channel into a (C, height, W) array."""
+        width = self.shape[1]
+        strip = np.empty((len(self.datasets), height, width), dtype=self.dtype)
+        for i, dataset in enumerate(self.datasets):
+            dataset.read(1, window=Window(0, row, width, height), out=strip[i])
+        if len(self.channels) != len(self.datasets):
+            strip = strip[self.channels]
+        return strip
+
+    def close(self):
+        for dataset in self.datasets:
+            dataset.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def infer_tile(read_rows, tile_shape, model, num_classes=OUT_CHANNELS, patch_size=PATCH_SIZE, overlap=OVERLAP,
+               blend='gaussian', batch_size=None, device=None, memory_budget_mb=MEMORY_BUDGET_MB):
+    """Classify a whole tile with overlapping sliding windows.
+
+    read_rows(row, height) must return the (C, height, W) input strip for
+    those rows. Windows are processed one row of windows at a time; their
+    logits are weighted by the blend window and summed into a float buffer
+    spanning just one window height of the tile. Once a window row is done,
+    the rows no later window can touch are final, so their argmax is written
+    to the class raster and the buffer slides down. Peak memory is therefore
+    bounded by one strip, whatever the tile size.
+    """
+    height, width = tile_shape
+    stride = patch_size - overlap
+    row_offsets = window_offsets(height, patch_size, stride)
+    col_offsets = window_offsets(width, patch_size, stride)
+    weights = blend_weights(patch_size, blend)
+
+    # Pad tiles narrower than one window up to a full window
+    padded_width = max(width, patch_size)
+
+    classes = np.full((height, width), NODATA, dtype=np.uint8)
+    accumulator = np.zeros((num_classes, patch_size, padded_width), dtype=np.float32)
+
+    for r, row in enumerate(row_offsets):
+        rows = min(patch_size, height - row)
+        strip = read_rows(row, rows)
+        if rows < patch_size or width < patch_size:
+            padded = np.zeros((strip.shape[0], patch_size, padded_width), dtype=strip.dtype)
+            padded[:, :rows, :width] = strip
+            strip = padded
+
+        if batch_size is None:
+            # Whatever the budget leaves after the accumulator and the input strip goes to model batches
+            budget = memory_budget_mb * 1024 * 1024 - accumulator.nbytes - strip.nbytes
+            batch_size = batch_size_for_budget((strip.shape[0], patch_size, patch_size), budget)
+        if r == 0:
+            print(f"Running sliding-window inference on {len(row_offsets) * len(col_offsets)} windows "
+                  f"with batch size {batch_size}")
+
+        windows = [strip[:, :, col:col + patch_size] for col in col_offsets]
+        for start, logits in forward_batches(model, windows, batch_size=batch_size, device=device, verbose=False):
+            logits = logits.float().cpu().numpy()
+            for offset, window_logits in enumerate(logits):
+                col = col_offsets[start + offset]
+                accumulator[:, :, col:col + patch_size] += window_logits * weights
+
+        # Rows above the next window row are complete: weights are positive,
+        # so the argmax of the weighted sum is the blended prediction
+        final_rows = (row_offsets[r + 1] - row) if r + 1 < len(row_offsets) else rows
+        classes[row:row + final_rows] = np.argmax(accumulator[:, :final_rows, :width], axis=0)
+
+        # Slide the accumulator down to start at the next window row
+        remaining = patch_size - final_rows
+        accumulator[:, :remaining] = accumulator[:, final_rows:]
+        accumulator[:, remaining:] = 0
+
+    return classes
+
+
+def write_class_raster(path, classes, profile):
+    """Write a class raster as a single-band COG on the grid described by profile."""
+    return write_cog(path, classes, crs=profile['crs'], transform=profile['transform'], nodata=NODATA)
+
+
+def infer_tile_files(channel_paths, model, output_tiff, **kwargs):
+    """Run sliding-window inference over a tile's band files and write the georeferenced class raster."""
+    with BandStackReader(channel_paths) as reader:
+        classes = infer_tile(reader.read_rows, reader.shape, model, **kwargs)
+        write_class_raster(output_tiff, classes, reader.profile)
+    print(f"Sliding-window class raster saved as {output_tiff}")
+    return classes, reader.profile
@@ -0,0 +1,16 @@
+# XYZ tile grid in web mercator (EPSG:3857), shared by the vector and raster tile servers
+
+# Half the width of the web mercator world, in meters
+ORIGIN_SHIFT = 20037508.342789244
+
+
+def tile_bounds(z, x, y):
+    """Web mercator (EPSG:3857) bounds of an XYZ tile as (left, bottom, right, top)."""
+    size = 2 * ORIGIN_SHIFT / 2 ** z
+    left = -ORIGIN_SHIFT + x * size
+    top = ORIGIN_SHIFT - y * size
+    return left, top - size, left + size, top
+
+
+def valid_tile(z, x, y, max_zoom):
+    return 0 <= z <= max_zoom and 0 <= x < 2 ** z and 0 <= y < 2 ** z
@@ -0,0 +1,233 @@
+import os
+import struct
+import threading
+
+import numpy as np
+import shapely
+from shapely.geometry import MultiPolygon
+from pyproj import Transformer
+
+from api.util.boundaryTiers import load_features
+from api.util.tileMath import ORIGIN_SHIFT, tile_bounds
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+
+# Tiles are cached per level and source file version under here
+TILE_CACHE_DIR = os.path.join(ROOT_DIR, 'tempData', 'tiles', 'boundaries')
+
+# level -> boundary GeoJSON served as that vector tile layer
+BOUNDARY_LEVELS = {
+    'provinces': 'provinces.json',
+    'districts': 'districts_cleaned.json',
+    'all': 'all.json',
+}
+
+MAX_ZOOM = 16
+
+# Tile coordinate grid and the margin (in tile units) kept around each tile, so clipped edges stay off-screen
+EXTENT = 4096
+BUFFER = 64
+
+MVT_MIME_TYPE = 'application/vnd.mapbox-vector-tile'
+
+# MVT geometry commands and feature type (Mapbox Vector Tile spec 2.1)
+MOVE_TO = 1
+LINE_TO = 2
+CLOSE_PATH = 7
+POLYGON = 3
+
+
+# --- Protocol buffer encoding, just what the MVT schema needs ---
+
+def varint(value):
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 31)
+
+
+def field(number, wire_type, payload):
+    """One protobuf field: varints (wire type 0) are passed as ints, length-delimited ones (2) as bytes."""
+    key = varint((number << 3) | wire_type)
+    if wire_type == 0:
+        return key + varint(payload)
+    return key + varint(len(payload)) + payload
+
+
+def packed(number, values):
+    return field(number, 2, b''.join(varint(v) for v in values))
+
+
+def encode_value(value):
+    """An MVT Value message: strings, bools, ints and doubles."""
+    if isinstance(value, bool):
+        return field(7, 0, int(value))
+    if isinstance(value, int):
+        return field(6, 0, (value << 1) ^ (value >> 63))
+    if isinstance(value, float):
+        # double_value is a fixed 64-bit field (wire type 1)
+        return varint((3 << 3) | 1) + struct.pack('<d', value)
+    return field(1, 2, str(value).encode('utf-8'))
+
+
+def ring_commands(ring, cursor):
+    """Commands of one closed ring of integer tile coordinates, relative to the previous cursor position."""
+    points = ring[:-1]
+    if len(points) < 3:
+        return [], cursor
+    commands = [(1 << 3) | MOVE_TO]
+    x, y = points[0]
+    commands += [zigzag(x - cursor[0]), zigzag(y - cursor[1])]
+    commands.append(((len(points) - 1) << 3) | LINE_TO)
+    previous = (x, y)
+    for x, y in points[1:]:
+        commands += [zigzag(x - previous[0]), zigzag(y - previous[1])]
+        previous = (x, y)
+    commands.append((1 << 3) | CLOSE_PATH)
+    return commands, previous
+
+
+def polygon_commands(geometry):
+    """MVT geometry commands of a (Multi)Polygon already in integer tile coordinates and oriented."""
+    commands, cursor = [], (0, 0)
+    for polygon in shapely.get_parts(geometry):
+        for ring in [polygon.exterior, *polygon.interiors]:
+            ring_coords = [(int(x), int(y)) for x, y in ring.coords]
+            ring_cmds, cursor = ring_commands(ring_coords, cursor)
+            commands += ring_cmds
+    return commands
+
+
+def encode_layer(name, features, extent=EXTENT):
+    """An MVT Layer message from (properties, tile geometry) pairs."""
+    keys, values = {}, {}
+    encoded_features = []
+    for properties, geometry in features:
+        commands = polygon_commands(geometry)
+        if not commands:
+            continue
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault((type(value).__name__, value), len(values)))
+        encoded_features.append(field(2, 2, packed(2, tags) + field(3, 0, POLYGON) + packed(4, commands)))
+
+    layer = field(15, 0, 2) + field(1, 2, name.encode('utf-8'))
+    layer += b''.join(encoded_features)
+    layer += b''.join(field(3, 2, key.encode('utf-8')) for key in keys)
+    layer += b''.join(field(4, 2, encode_value(value)) for _, value in values)
+    layer += field(5, 0, extent)
+    return field(3, 2, layer)
+
+
+# --- Boundary layers ---
+
+class BoundaryLayer:
+    """A boundary level in web mercator, indexed for tile queries and simplified per zoom on first use."""
+
+    def __init__(self, path):
+        self.path = path
+        self.version = os.stat(path).st_mtime_ns
+        features, geometries = load_features(path)
+        self.properties = [feature["properties"] for feature in features]
+        to_mercator = Transformer.from_crs('EPSG:4326', 'EPSG:3857', always_xy=True)
+        self.geometries = shapely.transform(geometries, lambda xy: np.column_stack(to_mercator.transform(xy[:, 0], xy[:, 1])))
+        self.tree = shapely.STRtree(self.geometries)
+        self._simplified = {}
+        self._lock = threading.Lock()
+
+    def simplified(self, z):
+        """All geometries simplified to a tile pixel at zoom z (topology of each feature preserved)."""
+        with self._lock:
+            if z not in self._simplified:
+                tolerance = 2 * ORIGIN_SHIFT / 2 ** z / EXTENT
+                self._simplified[z] = shapely.simplify(self.geometries, tolerance, preserve_topology=True)
+            return self._simplified[z]
+
+    def tile_features(self, z, x, y, extent=EXTENT, buffer=BUFFER):
+        """(properties, geometry in integer tile coordinates) of every feature in a tile, clipped to its buffer."""
+        left, bottom, right, top = tile_bounds(z, x, y)
+        scale = extent / (right - left)
+        margin = buffer / scale
+        clip = (left - margin, bottom - margin, right + margin, top + margin)
+
+        geometries = self.simplified(z)
+        features = []
+        for index in self.tree.query(shapely.box(*clip)):
+            geometry = shapely.clip_by_rect(geometries[index], *clip)
+            if geometry.is_empty:
+                continue
+            # Mercator meters -> tile units, y pointing down
+            geometry = shapely.transform(geometry, lambda xy: np.column_stack(((xy[:, 0] - left) * scale, (top - xy[:, 1]) * scale)))
+            geometry = polygonal(shapely.set_precision(geometry, 1.0))
+            if geometry is None:
+                continue
+            # MVT exterior rings have positive area in tile coordinates, holes negative
+            features.append((self.properties[index], shapely.orient_polygons(geometry, exterior_cw=False)))
+        return features
+
+
+def polygonal(geometry):
+    """The polygons of a geometry (snapping can leave stray lines and points), or None."""
+    polygons = [p for p in shapely.get_parts(geometry) if p.geom_type == "Polygon" and not p.is_empty]
+    if not polygons:
+        return None
+    return polygons[0] if len(polygons) == 1 else MultiPolygon(polygons)
+
+
+class BoundaryTiles:
+    """Vector tiles of the boundary levels, rendered on demand and cached on disk.
+
+    Cached tiles live under cache_dir/<level>/<source mtime>/z/x/y.pbf, so
+    editing a boundary file starts a fresh cache for that level.
+    """
+
+    def __init__(self, root_dir=ROOT_DIR, levels=BOUNDARY_LEVELS, cache_dir=TILE_CACHE_DIR):
+        self.root_dir = root_dir
+        self.levels = levels
+        self.cache_dir = cache_dir
+        self._layers = {}
+        self._lock = threading.Lock()
+
+    def layer(self, level):
+        path = os.path.join(self.root_dir, self.levels[level])
+        version = os.stat(path).st_mtime_ns
+        layer = self._layers.get(level)
+        if layer is None or layer.version != version:
+            with self._lock:
+                layer = self._layers.get(level)
+                if layer is None or layer.version != version:
+                    layer = BoundaryLayer(path)
+                    self._layers[level] = layer
+        return layer
+
+    def tile(self, level, z, x, y):
+        """Encoded MVT bytes of a tile (empty for a tile without features); raises KeyError for unknown levels."""
+        if level not in self.levels:
+            raise KeyError(level)
+        layer = self.layer(level)
+        cache_path = os.path.join(self.cache_dir, level, str(layer.version), str(z), str(x), f"{y}.pbf")
+        if os.path.exists(cache_path):
+            with open(cache_path, 'rb') as f:
+                return f.read()
+
+        features = layer.tile_features(z, x, y)
+        data = encode_layer(level, features) if features else b''
+
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        partial = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.part"
+        with open(partial, 'wb') as f:
+            f.write(data)
+        os.replace(partial, cache_path)
+        return data
+
+
+boundary_tiles = BoundaryTiles()
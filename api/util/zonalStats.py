@@ -0,0 +1,83 @@
+import os
+import hashlib
+
+import numpy as np
+from rasterio.features import rasterize
+from rasterio.transform import Affine
+
+# Zone rasters are cached per (geometries, grid), so re-running stats on the same mosaic grid skips rasterization
+ZONE_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'tempData', 'zones')
+
+# Rows rasterized / counted at a time, so memory stays bounded for province-sized mosaics
+BLOCK_ROWS = 2048
+
+
+def zone_cache_key(geometries, shape, transform):
+    digest = hashlib.sha256()
+    digest.update(repr((tuple(shape), tuple(transform)[:6])).encode('utf-8'))
+    for geometry in geometries:
+        digest.update(geometry.wkb)
+    return digest.hexdigest()[:24]
+
+
+def zone_raster(geometries, shape, transform, cache_dir=ZONE_CACHE_DIR, block_rows=BLOCK_ROWS):
+    """Rasterize geometries onto a grid: pixel value i + 1 for geometries[i], 0 outside all of them.
+
+    Pixels are assigned by their center, as rasterio.mask.mask does; where
+    geometries overlap the later one wins. The grid is rasterized block by
+    block into a memory-mapped file cached for the grid, so every season
+    mosaicked onto the same grid reuses it.
+    """
+    path = None
+    if cache_dir:
+        path = os.path.join(cache_dir, zone_cache_key(geometries, shape, transform) + '.npy')
+        if os.path.exists(path):
+            return np.load(path, mmap_mode='r')
+
+    dtype = np.uint8 if len(geometries) < 255 else np.uint16 if len(geometries) < 65535 else np.int32
+    if path:
+        os.makedirs(cache_dir, exist_ok=True)
+        partial = f"{path}.part.npy"
+        zones = np.lib.format.open_memmap(partial, mode='w+', dtype=dtype, shape=tuple(shape))
+    else:
+        zones = np.zeros(tuple(shape), dtype=dtype)
+
+    shapes = [(geometry, i + 1) for i, geometry in enumerate(geometries)]
+    for row in range(0, shape[0], block_rows):
+        height = min(block_rows, shape[0] - row)
+        zones[row:row + height] = rasterize(
+            shapes,
+            out_shape=(height, shape[1]),
+            transform=transform * Affine.translation(0, row),
+            fill=0,
+            dtype=dtype,
+        )
+
+    if path:
+        zones.flush()
+        del zones
+        os.replace(partial, path)
+        return np.load(path, mmap_mode='r')
+    return zones
+
+
+def zonal_class_counts(zones, classes, num_zones, num_classes, nodata=None, block_rows=BLOCK_ROWS):
+    """Pixel count of every class in every zone, in a single pass over the class raster.
+
+    classes is an array aligned with zones, or a read_rows(row, height)
+    callable returning that strip of it, e.g. windowed reads of a mosaic.
+    Returns a (num_zones + 1, num_classes) array; row 0 counts pixels
+    outside all zones. Pixels equal to nodata or outside [0, num_classes)
+    are not counted.
+    """
+    counts = np.zeros((num_zones + 1) * num_classes, dtype=np.int64)
+    for row in range(0, zones.shape[0], block_rows):
+        height = min(block_rows, zones.shape[0] - row)
+        block = classes(row, height) if callable(classes) else classes[row:row + height]
+        zone_block = zones[row:row + height]
+        valid = (block >= 0) & (block < num_classes)
+        if nodata is not None:
+            valid &= block != nodata
+        index = zone_block[valid].astype(np.int64) * num_classes + block[valid]
+        counts += np.bincount(index, minlength=counts.size)
+    return counts.reshape(num_zones + 1, num_classes)
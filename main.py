@@ -1,6 +1,9 @@
-from flask import Flask, jsonify, request
-import json
+from flask import Flask, Response, jsonify, request
+import os
 from api.routes.map import map_bp
+from api.routes.tiles import tiles_bp
+from api.util.jobQueue import get_job_queue
+from api.util.geojsonCache import geojson_cache, select_tier, GEOJSON_LEVELS, DEFAULT_LEVEL
 from flask_cors import CORS  # Import CORS from flask_cors
 
 app = Flask(__name__)
@@ -11,34 +14,49 @@ CORS(app)
 # Register the blueprint for map-related routes
 app.register_blueprint(map_bp)
 
+# Register the blueprint for vector tile routes
+app.register_blueprint(tiles_bp)
+
+# Optionally load the UNet at startup so the first request doesn't pay for torch.load
+if os.environ.get('PRELOAD_MODELS') == '1':
+    from api.model.registry import preload_models
+    preload_models()
+
+# Start the map job workers now, so jobs queued or interrupted before a restart resume straight away
+# (under the debug reloader, only in the child process that serves requests)
+if __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    get_job_queue()
+
+# Optionally parse and compress the boundary GeoJSON up front instead of on the first request
+if os.environ.get('PRELOAD_GEOJSON') == '1':
+    geojson_cache.preload()
+
 @app.route('/api/geojson', methods=['GET'])
 def get_geojson():
     # Get the 'level' query parameter from the request
-    level = request.args.get('level', 'districts')  # Default to 'districts' if no level is provided
-    
-    # Determine the file to read based on the level
-    if level == 'provinces':
-        file_name = 'provinces.json'
-    elif level == 'all':
-        file_name = 'all.json'
-    else:
-        file_name = 'districts.json'
-
-    # Load the geojson file
+    level = request.args.get('level', DEFAULT_LEVEL)  # Default to 'districts' if no level is provided
+    if level not in GEOJSON_LEVELS:
+        level = DEFAULT_LEVEL
+
+    # Optional map zoom or tolerance (degrees) picks a simplified, quantized tier; neither means full resolution
+    tier = select_tier(
+        zoom=request.args.get('zoom', type=float),
+        tolerance=request.args.get('tolerance', type=float)
+    )
+
+    # Serialized once per file version; repeated requests reuse the precompressed body
     try:
-        with open(file_name, 'r') as f:
-            geojson_data = json.load(f)
+        cached = geojson_cache.get(level, tier)
     except FileNotFoundError:
-        return jsonify({"error": f"{file_name} not found"}), 404
-
-    # Extract the names of the polygons (district or province names in "NAME_3" or "NAME_1" depending on the level)
-    polygons = [
-        {"name": feature["properties"].get("NAME_1" if level == 'provinces' else "NAME_3"),
-         "id": feature["properties"].get("GID_1" if level == 'provinces' else "GID_3")}
-        for feature in geojson_data["features"]
-    ]
-    
-    return jsonify({"polygons": polygons, "geojson": geojson_data})
+        return jsonify({"error": f"{GEOJSON_LEVELS[level][0]} not found"}), 404
+
+    encoding, body, etag = cached.encode(request.accept_encodings)
+    headers = {"ETag": f'"{etag}"', "Vary": "Accept-Encoding"}
+    if etag in request.if_none_match:
+        return Response(status=304, headers=headers)
+    if encoding != 'identity':
+        headers["Content-Encoding"] = encoding
+    return Response(body, mimetype='application/json', headers=headers)
 
 if __name__ == '__main__':
     #port 5091
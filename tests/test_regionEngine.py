@@ -0,0 +1,59 @@
+import os
+import sys
+import json
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_bounds
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from api.util import regionEngine
+from api.util.runManifest import RunManifest
+
+# One 40x40 px tile over a 0.1 degree square
+WEST, SOUTH, EAST, NORTH = 72.0, 31.0, 72.1, 31.1
+
+
+def write_run(run_dir):
+    """A run directory as createLargeOutputMap leaves it: tile TIFF, tile JSON, data.json and manifest.json."""
+    os.makedirs(run_dir)
+    classes = np.arange(40 * 40, dtype=np.uint8).reshape(40, 40) % 14
+    profile = {
+        "driver": "GTiff", "height": 40, "width": 40, "count": 1, "dtype": "uint8", "nodata": 255,
+        "crs": "EPSG:4326", "transform": from_bounds(WEST, SOUTH, EAST, NORTH, 40, 40),
+    }
+    with rasterio.open(os.path.join(run_dir, "stitched_tile_T00AAA.tiff"), 'w', **profile) as dst:
+        dst.write(classes, 1)
+    with open(os.path.join(run_dir, "data_T00AAA.json"), 'w') as f:
+        json.dump({"tiles": [["stitched_tile_T00AAA.png", NORTH, SOUTH, EAST, WEST]],
+                   "classification_tiff": "stitched_tile_T00AAA.tiff"}, f)
+    with open(os.path.join(run_dir, "data.json"), 'w') as f:
+        json.dump({"name": "run", "tiles": []}, f)
+    RunManifest.open(run_dir, name="run")
+
+
+def write_boundary(path):
+    ring = [[WEST, SOUTH], [EAST, SOUTH], [EAST, NORTH], [WEST, NORTH], [WEST, SOUTH]]
+    with open(path, 'w') as f:
+        json.dump({"type": "FeatureCollection", "features": [{
+            "type": "Feature", "properties": {"NAME_1": "Punjab"},
+            "geometry": {"type": "Polygon", "coordinates": [ring]},
+        }]}, f)
+
+
+def test_render_region_skips_run_manifest(tmp_path, monkeypatch):
+    run_dir = str(tmp_path / "run")
+    write_run(run_dir)
+    boundary = str(tmp_path / "boundary.json")
+    write_boundary(boundary)
+    monkeypatch.setattr(regionEngine, "MOSAIC_DIR", str(tmp_path / "mosaics"))
+
+    assert len(regionEngine.read_tile_metas(run_dir)) == 1
+
+    summaries = regionEngine.render_region(
+        run_dir, str(tmp_path / "png"), str(tmp_path / "json"), "Punjab", "Jan-Apr", 2025,
+        boundary=boundary, district_maps=False, workers=1
+    )
+    assert set(summaries) == {"Punjab"}
+    assert os.path.exists(tmp_path / "png" / "Jan-Apr_2025_Punjab.png")
+    assert os.path.exists(tmp_path / "json" / "Jan-Apr_2025_Punjab.json")